@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Incremental rolling z-score anomaly detector.
+
+Every series keeps a fixed 14-day window (ring buffer) with a running mean and
+sum of squared deviations, updated Welford-style: a new day evicts the oldest
+value and adds the new one, so each day costs O(1) per series and all series of
+a level advance together in one vectorized step. The running moments are
+recomputed exactly from the buffer each time it wraps to bound float drift.
+As in the original check, a day's z-score is measured against the window that
+includes it (min 7 days, sample std).
+
+Levels:
+
+- `chain`: the `daily_sales` metrics.
+- `store`: `store_rollup` per store.
+- `store_category`: `category_rollup` per store x category.
+
+Rollup days on which a series has no sales count as 0. That includes the days
+before a series is first seen (a new store, a category's first sale at a
+store): a full build zero-fills it from the first day, and an incremental
+update back-fills the zeros into the window, so both give the same scores.
+
+State and the scored days live in `anomaly_state.joblib` next to the data. The
+last day seen is treated as provisional, the same way the rollups treat it: it
+is scored but not committed, and it is re-read on the next update. For each
+level and metric, the scored days are kept sorted by |z|, so a threshold query
+is a binary search rather than a rescan of history.
+
+The state also holds a fingerprint of the committed rows. If those rows change,
+e.g. after a dataset is regenerated, the level is rebuilt from scratch instead
+of extending a history that no longer exists.
+"""
+import argparse, copy, os, sys, tempfile
+import joblib, numpy as np, pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
+
+WINDOW = 14
+MIN_PERIODS = 7
+STATE_FILE = 'anomaly_state.joblib'
+LEVELS = {
+    'chain': {'table': 'daily_sales', 'keys': [], 'metrics': ['revenue', 'orders', 'units', 'visits']},
+    'store': {'table': 'store_rollup', 'keys': ['store_id'], 'metrics': ['revenue', 'orders', 'units']},
+    'store_category': {'table': 'category_rollup', 'keys': ['store_id', 'category'], 'metrics': ['revenue', 'units']},
+}
+
+
+class RollingWindow:
+    """Rolling mean / variance over the last `window` values of many series (rows)."""
+
+    def __init__(self, n_series, window=WINDOW):
+        self.window = window; self.pos = 0
+        self.buf = np.zeros((n_series, window)); self.n = np.zeros(n_series, int)
+        self.mean = np.zeros(n_series); self.m2 = np.zeros(n_series)
+
+    def grow(self, n_series):
+        # new series get the zeros they would have had since the first day: every series is pushed every day, so
+        # the oldest one's count is min(days pushed, window) and the shared ring position fits the new rows as well
+        extra = n_series - len(self.n)
+        if extra <= 0: return
+        filled = int(self.n.max()) if len(self.n) else 0
+        self.buf = np.vstack([self.buf, np.zeros((extra, self.window))]); self.n = np.concatenate([self.n, np.full(extra, filled)])
+        self.mean = np.concatenate([self.mean, np.zeros(extra)]); self.m2 = np.concatenate([self.m2, np.zeros(extra)])
+
+    def push(self, x):
+        """Add one value per series and return each value's z-score (NaN until MIN_PERIODS or when std is 0)."""
+        x = np.asarray(x, float); full = self.n == self.window; old = self.buf[:, self.pos]
+        n = self.n - full
+        mean = np.where(full, self.mean + (self.mean - old) / np.maximum(n, 1), self.mean)
+        m2 = np.where(full, self.m2 - (old - self.mean) * (old - mean), self.m2)
+        n = n + 1; d = x - mean; mean = mean + d / n; m2 = m2 + d * (x - mean)
+        self.buf[:, self.pos] = x; self.n, self.mean, self.m2 = n, mean, m2
+        self.pos = (self.pos + 1) % self.window
+        if self.pos == 0:
+            f = self.n == self.window
+            self.mean[f] = self.buf[f].mean(axis=1); self.m2[f] = ((self.buf[f] - self.mean[f, None]) ** 2).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sd = np.sqrt(np.maximum(self.m2, 0) / (self.n - 1))
+            # evictions leave ~1e-16-relative residue where the window is constant; treat that as zero spread
+            scale = np.abs(self.buf).max(axis=1)
+            z = (x - self.mean) / np.where((scale > 0) & (sd > 1e-9 * scale), sd, np.nan)
+        return np.where(self.n >= MIN_PERIODS, z, np.nan)
+
+
+def _new_level(spec):
+    return {'keys': pd.DataFrame(columns=spec['keys']), 'through': None, 'window': RollingWindow(0), 'fingerprint': 0,
+            'events': {m: _events([], [], [], []) for m in spec['metrics']}}
+
+
+def _fingerprint(df, spec):
+    # rounded, so the same rows re-aggregated in another order (last-bit float differences) still match
+    return storage.fingerprint(df[['date'] + spec['keys']].assign(**df[spec['metrics']].round(6)))
+
+
+def _events(dates, series, values, z):
+    z = np.asarray(z, float); order = np.argsort(-np.abs(z), kind='stable')
+    return pd.DataFrame({'date': pd.to_datetime(np.asarray(dates))[order], 'series': np.asarray(series, int)[order],
+                         'value': np.asarray(values, float)[order], 'z': z[order], 'neg_abs_z': -np.abs(z[order])})
+
+
+def _panel(df, st, spec, days):
+    """(series x metric x day) values for the new days, registering series seen for the first time."""
+    keys, metrics = spec['keys'], spec['metrics']
+    if not keys:
+        st['keys'] = pd.DataFrame(index=[0])
+        return np.nan_to_num(df.groupby('date')[metrics].sum().reindex(days).to_numpy(float).T[None])
+    seen = df[keys].drop_duplicates()
+    st['keys'] = seen.reset_index(drop=True) if st['keys'].empty else pd.concat([st['keys'], seen]).drop_duplicates(ignore_index=True)
+    g = df.groupby(keys + ['date'])[metrics].sum()
+    X = np.zeros((len(st['keys']), len(metrics), len(days)))
+    known = pd.MultiIndex.from_frame(st['keys']) if len(keys) > 1 else pd.Index(st['keys'][keys[0]])
+    row = known.get_indexer(g.index.droplevel('date'))
+    X[row, :, days.get_indexer(g.index.get_level_values('date'))] = np.nan_to_num(g.to_numpy(float))
+    return X
+
+
+def _update_level(st, spec, path):
+    df = storage.read(path, columns=['date'] + spec['keys'] + spec['metrics'])
+    df['date'] = pd.to_datetime(df['date']).dt.floor('D')
+    if st['through'] is not None:
+        if _fingerprint(df[df['date'] <= st['through']], spec) != st.get('fingerprint'):
+            st.clear(); st.update(_new_level(spec))  # committed days were rewritten: rescan everything
+        else: df = df[df['date'] > st['through']]
+    if df.empty: return
+    days = pd.DatetimeIndex(sorted(df['date'].unique()))
+    X = _panel(df, st, spec, days); S, M, D = X.shape
+    win = st['window']; win.grow(S * M)
+    Z = np.empty_like(X)
+    for i in range(D):
+        if i == D - 1: committed = copy.deepcopy(win)  # the last day stays provisional
+        Z[:, :, i] = win.push(X[:, :, i].ravel()).reshape(S, M)
+    st['window'] = committed
+    if D > 1:
+        st['through'] = days[-2]; st['fingerprint'] = (st['fingerprint'] + _fingerprint(df[df['date'] <= days[-2]], spec)) % (1 << 64)
+    for j, m in enumerate(spec['metrics']):
+        old = st['events'][m]; old = old[old['date'] < days[0]]
+        s, d = np.nonzero(np.isfinite(Z[:, j, :]))
+        new = _events(days[d], s, X[s, j, d], Z[s, j, d])
+        st['events'][m] = _events(np.concatenate([old['date'].to_numpy(), new['date'].to_numpy()]), np.concatenate([old['series'], new['series']]),
+                                  np.concatenate([old['value'], new['value']]), np.concatenate([old['z'], new['z']]))
+
+
+def update(data_dir, fmt=None, state=None, persist=True):
+    """Fold days not yet seen into the state for every level whose table exists; returns the new state.
+
+    `state` defaults to the one saved under `data_dir`; a given state is copied, not modified, so readers of it
+    are unaffected. With `persist` the result is saved there (atomically, through a uniquely named temp file).
+    """
+    path = os.path.join(data_dir, STATE_FILE)
+    if state is None: state = joblib.load(path) if os.path.exists(path) else {'levels': {}}
+    else: state = copy.deepcopy(state)
+    for level, spec in LEVELS.items():
+        src = storage.table_path(data_dir, spec['table'], fmt)
+        if not os.path.exists(src): continue
+        _update_level(state['levels'].setdefault(level, _new_level(spec)), spec, src)
+    if persist:
+        fd, tmp = tempfile.mkstemp(prefix=STATE_FILE + '.', suffix='.tmp', dir=data_dir); os.close(fd)
+        try: joblib.dump(state, tmp); os.replace(tmp, path)
+        except BaseException: os.remove(tmp); raise
+    return state
+
+
+def query(state, z=3.0, level='chain', metric='revenue', store_id=None, category=None):
+    """Days with |z| >= `z` for one level and metric, in date order."""
+    if level not in LEVELS: raise ValueError(f"unknown level {level!r}; choose from {list(LEVELS)}")
+    if metric not in LEVELS[level]['metrics']: raise ValueError(f"unknown metric {metric!r} for {level}; choose from {LEVELS[level]['metrics']}")
+    st = state['levels'].get(level)
+    if st is None: return pd.DataFrame(columns=['date'] + LEVELS[level]['keys'] + [metric, 'z'])
+    ev = st['events'][metric]; k = np.searchsorted(ev['neg_abs_z'].to_numpy(), -z, side='right')
+    hit = ev.iloc[:k]; keys = st['keys'].iloc[hit['series'].to_numpy()].reset_index(drop=True)
+    out = pd.concat([hit[['date']].reset_index(drop=True), keys[LEVELS[level]['keys']], hit[['value', 'z']].reset_index(drop=True)], axis=1).rename(columns={'value': metric})
+    if store_id is not None and 'store_id' in out: out = out[out['store_id'] == int(store_id)]
+    if category and 'category' in out: out = out[out['category'] == category]
+    return out.sort_values(['date'] + LEVELS[level]['keys'], kind='stable', ignore_index=True)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--data_dir', default='data/raw')
+    ap.add_argument('--rebuild', action='store_true', help='discard the saved state and rescan all history')
+    a = ap.parse_args()
+    if a.rebuild and os.path.exists(os.path.join(a.data_dir, STATE_FILE)): os.remove(os.path.join(a.data_dir, STATE_FILE))
+    st = update(a.data_dir)
+    print('; '.join(f"{lvl}: {len(s['keys'])} series through {s['through'].date() if s['through'] is not None else '-'}" for lvl, s in st['levels'].items()))
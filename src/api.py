@@ -1,71 +1,188 @@
 #!/usr/bin/env python3
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import Optional
-import pandas as pd, numpy as np, os
-app=FastAPI(title='Retail Analytics API')
-app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+import pandas as pd, numpy as np, os, shutil, sys, threading
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from datastore import DatasetStore, DATA_TABLES, MODEL_TABLES
+import anomaly, basket, forecasting, instrument, responses, rollup, storage
+from instrument import span
+from collections import OrderedDict
+from registry import ModelRegistry
+from jobs import JobRunner
+class TimedJSONResponse(JSONResponse):
+    def render(self, content):
+        with span('encode'): return super().render(content)
+app=FastAPI(title='Retail Analytics API', default_response_class=TimedJSONResponse)
 DATA=os.environ.get('DATA_DIR','data/raw'); MODEL=os.environ.get('MODEL_DIR','models')
+PROFILES=os.environ.get('API_PROFILE_DIR', os.path.join(MODEL, 'profiles'))
+app.add_middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'], expose_headers=['ETag', 'X-Next-Cursor', 'Server-Timing', 'X-Profile-Id'])
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# outermost, so latency covers compression and CORS too
+app.add_middleware(instrument.InstrumentMiddleware, profile_dir=PROFILES, profile_rate=float(os.environ.get('API_PROFILE_RATE', '0')),
+                   profile_interval=float(os.environ.get('API_PROFILE_INTERVAL_MS', '5'))/1000)
+STORE=DatasetStore(DATA, DATA_TABLES); MODELS=DatasetStore(MODEL, MODEL_TABLES); REGISTRY=ModelRegistry(MODEL)
 
 @app.get('/health')
 def health(): return {'status':'ok'}
 
 @app.get('/metrics/overview')
 def overview(date_from: Optional[str]=None, date_to: Optional[str]=None):
-    d=pd.read_csv(os.path.join(DATA,'daily_sales.csv'), parse_dates=['date']).sort_values('date')
-    if date_from: d=d[d['date']>=pd.to_datetime(date_from)]
-    if date_to: d=d[d['date']<=pd.to_datetime(date_to)]
-    if d.empty: return {'error':'no data'}
-    return {'revenue': float(d['revenue'].sum()), 'orders': int(d['orders'].sum()), 'units': int(d['units'].sum()), 'aov': float(d['revenue'].sum()/max(1,d['orders'].sum())), 'conversion': float(d['orders'].sum()/max(1,d['visits'].sum())), 'date_min': str(d['date'].min().date()), 'date_max': str(d['date'].max().date())}
+    d=STORE.get('daily_sales')
+    with span('compute'):
+        if date_from: d=d[d['date']>=pd.to_datetime(date_from)]
+        if date_to: d=d[d['date']<=pd.to_datetime(date_to)]
+        if d.empty: return {'error':'no data'}
+        return {'revenue': float(d['revenue'].sum()), 'orders': int(d['orders'].sum()), 'units': int(d['units'].sum()), 'aov': float(d['revenue'].sum()/max(1,d['orders'].sum())), 'conversion': float(d['orders'].sum()/max(1,d['visits'].sum())), 'date_min': str(d['date'].min().date()), 'date_max': str(d['date'].max().date())}
+
+def _rows(df, fmt, tag, next_cursor, response):
+    # records (default), columnar JSON or an Arrow IPC stream; ETag / next-cursor travel as headers
+    with span('serialize'):
+        if fmt=='arrow': return Response(responses.arrow(df), media_type=responses.ARROW_MEDIA_TYPE, headers=responses.headers(tag, next_cursor))
+        response.headers.update(responses.headers(tag, next_cursor))
+        return responses.columnar(df) if fmt=='columns' else df.to_dict(orient='records')
 
 @app.get('/metrics/daily')
-def daily(date_from: Optional[str]=None, date_to: Optional[str]=None):
-    d=pd.read_csv(os.path.join(DATA,'daily_sales.csv'), parse_dates=['date']).sort_values('date')
-    if date_from: d=d[d['date']>=pd.to_datetime(date_from)]
-    if date_to: d=d[d['date']<=pd.to_datetime(date_to)]
-    return d.to_dict(orient='records')
+def daily(request: Request, response: Response, date_from: Optional[str]=None, date_to: Optional[str]=None, fields: Optional[str]=None,
+          limit: Optional[int]=None, cursor: Optional[str]=None, format: str='json'):
+    """Daily KPI rows by date; see responses.py for fields / limit / cursor / format and ETag revalidation."""
+    if format not in responses.FORMATS: return {'error':f'format must be one of {list(responses.FORMATS)}'}
+    if limit is not None and limit<1: return {'error':'limit must be positive'}
+    tag=responses.etag(STORE.version('daily_sales'), date_from=date_from, date_to=date_to, fields=fields, limit=limit, cursor=cursor, format=format)
+    cached=responses.not_modified(request, tag)
+    if cached: return cached
+    d=STORE.get('daily_sales')
+    with span('compute'):
+        if date_from: d=d[d['date']>=pd.to_datetime(date_from)]
+        if date_to: d=d[d['date']<=pd.to_datetime(date_to)]
+        try: d, nxt=responses.page(d, 'date', cursor, limit); d=responses.project(d, fields)
+        except ValueError as e: return {'error': str(e)}
+    return _rows(d, format, tag, nxt, response)
 
 @app.get('/rfm/segments')
-def rfm():
-    p=os.path.join(MODEL,'rfm_segments.csv')
-    if not os.path.exists(p): return {'error':'no rfm_segments.csv found; run training.'}
-    df=pd.read_csv(p); return {'counts': df['segment'].value_counts().sort_index().to_dict(), 'sample': df.head(20).to_dict(orient='records')}
+def rfm(request: Request, response: Response, fields: Optional[str]=None, limit: int=20, cursor: Optional[str]=None, format: str='json'):
+    """Segment counts plus a page of customers (`limit`, default 20, continued with `cursor`); `format=arrow` returns just the page."""
+    if not MODELS.exists('rfm_segments'): return {'error':'no rfm_segments.csv found; run training.'}
+    if format not in responses.FORMATS: return {'error':f'format must be one of {list(responses.FORMATS)}'}
+    if limit<1: return {'error':'limit must be positive'}
+    tag=responses.etag(MODELS.version('rfm_segments'), fields=fields, limit=limit, cursor=cursor, format=format)
+    cached=responses.not_modified(request, tag)
+    if cached: return cached
+    df=MODELS.get('rfm_segments')
+    with span('compute'):
+        try: rows, nxt=responses.page(df, 'customer_id', cursor, limit); rows=responses.project(rows, fields)
+        except ValueError as e: return {'error': str(e)}
+        counts=df['segment'].value_counts().sort_index().to_dict()
+    if format=='arrow': return _rows(rows, format, tag, nxt, response)
+    return {'counts': counts, 'sample': _rows(rows, format, tag, nxt, response)}
+
+_BASKET={'version': None, 'cooc': None}; _BASKET_LOCK=threading.Lock()
+def _basket():
+    # co-occurrence artifact kept warm; appended transactions are folded in memory only
+    # (train_models.py / basket.py persist it), so a GET never writes to MODEL_DIR
+    v=STORE.version('transactions')
+    with _BASKET_LOCK:
+        if _BASKET['version']!=v:
+            _BASKET.update(version=v, cooc=basket.update(_BASKET['cooc'] or basket.load(MODEL), STORE.get('transactions')))
+        return _BASKET['cooc']
 
 @app.get('/basket/top_pairs')
-def pairs(n:int=10):
-    tx=pd.read_csv(os.path.join(DATA,'transactions.csv')); pairs={}
-    for oid, grp in tx.groupby('order_id'):
-        items=sorted(grp['product_id'].unique())
-        for i in range(len(items)):
-            for j in range(i+1,len(items)):
-                key=(int(items[i]),int(items[j])); pairs[key]=pairs.get(key,0)+1
-    out=sorted([{'p1':a,'p2':b,'count':c} for (a,b),c in pairs.items()], key=lambda x:x['count'], reverse=True)[:n]
-    return {'pairs': out}
+def pairs(n:int=10, date_from: Optional[str]=None, date_to: Optional[str]=None, store_id: Optional[int]=None):
+    with span('compute'): return {'pairs': basket.top_pairs(_basket(), n, date_from, date_to, store_id)}
+
+_ANOMALY={'version': None, 'state': None}; _ANOMALY_LOCK=threading.Lock()
+def _anomaly_state():
+    # detector state is folded forward only when a source table changes; queries never rescan history.
+    # the fold stays in memory: preprocess owns the saved state, so a GET never writes to DATA_DIR
+    v=STORE.version(*(spec['table'] for spec in anomaly.LEVELS.values()))
+    with _ANOMALY_LOCK:
+        if _ANOMALY['version']!=v: _ANOMALY.update(version=v, state=anomaly.update(DATA, state=_ANOMALY['state'], persist=False))
+        return _ANOMALY['state']
 
 @app.get('/alerts/anomalies')
-def anomalies(z: float = 3.0):
-    d=pd.read_csv(os.path.join(DATA,'daily_sales.csv'), parse_dates=['date']).sort_values('date')
-    x=d['revenue']; mu=x.rolling(14, min_periods=7).mean(); sd=x.rolling(14, min_periods=7).std().replace(0, np.nan); zscore=(x-mu)/sd; d['z']=zscore
-    return d[abs(d['z'])>=z][['date','revenue','z']].to_dict(orient='records')
+def anomalies(z: float = 3.0, level: str='chain', metric: str='revenue', store_id: Optional[int]=None, category: Optional[str]=None):
+    with span('compute'):
+        try: out=anomaly.query(_anomaly_state(), z, level, metric, store_id, category)
+        except ValueError as e: return {'error': str(e)}
+    with span('serialize'): return out.to_dict(orient='records')
+
+_FORECASTS=OrderedDict(); _FORECAST_LOCK=threading.Lock()
+def _chain_forecast(h):
+    # one path per (data version, model version), kept at the longest horizon asked for; shorter horizons are prefixes
+    d=STORE.get('daily_sales'); lr, mv=REGISTRY.get('daily_revenue_lr'); key=(STORE.version('daily_sales'), mv)
+    with _FORECAST_LOCK:
+        hit=_FORECASTS.get(key)
+        if hit and len(hit[2])>=h: _FORECASTS.move_to_end(key); return hit[0], hit[1][:h], hit[2][:h]
+    last=d['date'].max()
+    if lr is None or len(d)<10: name='naive-mean7'; preds=np.full(h, float(d.tail(7)['revenue'].mean()))
+    else: name='linear_regression_lags'; preds=forecasting.recursive_forecast(lr.predict, *[[x] for x in forecasting.lag_state(d['revenue'])], h)[0]
+    dates=[str((last+pd.Timedelta(days=i)).date()) for i in range(1,h+1)]; preds=[float(y) for y in preds]
+    with _FORECAST_LOCK:
+        _FORECASTS[key]=(name, dates, preds)
+        while len(_FORECASTS)>32: _FORECASTS.popitem(last=False)
+    return name, dates, preds
 
 @app.get('/forecast/daily')
 def forecast(h:int=14):
-    import joblib
-    d=pd.read_csv(os.path.join(DATA,'daily_sales.csv'), parse_dates=['date']).sort_values('date')
-    mp=os.path.join(MODEL,'daily_revenue_lr.joblib')
-    if (not os.path.exists(mp)) or (len(d)<10):
-        mean=float(d.tail(7)['revenue'].mean()); last=d['date'].max()
-        return {'model':'naive-mean7','pred':[{'date': str((last+pd.Timedelta(days=i)).date()), 'pred': mean} for i in range(1,h+1)]}
-    lr=joblib.load(mp); df=d.copy(); df['t']=range(len(df)); 
-    for lag in [1,7]: df[f'rev_lag{lag}']=df['revenue'].shift(lag)
-    last=df['date'].max(); last_t=df['t'].iloc[-1]; lag1=df['revenue'].iloc[-1]; lag7=df['revenue'].iloc[-7] if len(df)>=7 else df['revenue'].iloc[0]
-    preds=[]; 
-    for i in range(1,h+1):
-        t=last_t+i; import numpy as np; y=float(lr.predict([[t, lag1, lag7]])[0]); preds.append({'date': str((last+pd.Timedelta(days=i)).date()), 'pred': y}); lag7 = lag1 if i>=6 else lag7; lag1 = y
-    return {'model':'linear_regression_lags','pred': preds}
+    if h<1: return {'error':'h must be a positive integer'}
+    with span('compute'): name, dates, preds=_chain_forecast(h)
+    with span('serialize'): return {'model':name,'pred':[{'date': d, 'pred': y} for d, y in zip(dates, preds)]}
+
+SERIES_LEVELS=['store_id','region','category']
+def _series_forecast(by, h, store_id=None, region=None, category=None):
+    # bottom-up: precomputed store x category paths are filtered, then summed to the requested level
+    art, _=REGISTRY.get('series_forecasts')
+    if art is None: return {'error':'no series forecasts found; run training with a category rollup.'}
+    unknown=[b for b in by if b not in SERIES_LEVELS]
+    if unknown: return {'error':f"unknown level(s) {unknown}; choose from {SERIES_LEVELS}"}
+    if h<1: return {'error':'h must be a positive integer'}
+    if h>len(art['dates']): return {'error':f"horizon {h} exceeds the {len(art['dates'])} precomputed days"}
+    keys=art['keys']; mask=np.ones(len(keys), bool)
+    if store_id is not None: mask&=(keys['store_id']==int(store_id)).to_numpy()
+    if region: mask&=(keys['region']==region).to_numpy()
+    if category: mask&=(keys['category']==category).to_numpy()
+    pred=pd.DataFrame(art['pred'][mask, :h].astype(float), columns=art['dates'][:h])
+    out=pred.groupby([keys.loc[mask, b].to_numpy() for b in by]).sum() if by else pred.sum().to_frame().T
+    rows=[]
+    for idx, vals in zip(out.index, out.to_numpy()):
+        idx=idx if isinstance(idx, tuple) else (idx,)
+        rows.append({**{b: (v.item() if hasattr(v, 'item') else v) for b, v in zip(by, idx)}, 'pred':[{'date': d, 'pred': float(y)} for d, y in zip(out.columns, vals)]})
+    return rows
+
+@app.get('/forecast/series')
+def forecast_series(h:int=14, by: str='store_id', store_id: Optional[int]=None, region: Optional[str]=None, category: Optional[str]=None):
+    """Per-series forecasts at any level: `by` is a comma list of store_id, region, category (empty for the chain total)."""
+    with span('compute'): rows=_series_forecast([b.strip() for b in by.split(',') if b.strip()], h, store_id, region, category)
+    return rows if isinstance(rows, dict) else {'model':'panel_linear_lags','series':rows}
+
+@app.get('/forecast/batch')
+def forecast_batch(horizons: str='7,14,28', by: Optional[str]=None, store_id: Optional[int]=None, region: Optional[str]=None, category: Optional[str]=None):
+    """Forecasts for several horizons from one cached path (comma-separated `horizons`).
+
+    With `by` (or any series filter) every matching store/category series is
+    answered from the precomputed per-series forecasts instead of the chain model.
+    """
+    try: hs=sorted({int(x) for x in horizons.split(',') if x.strip()})
+    except ValueError: hs=[]
+    if not hs or hs[0]<1: return {'error':'horizons must be positive integers'}
+    if by is None and store_id is None and region is None and category is None:
+        with span('compute'): name, dates, preds=_chain_forecast(hs[-1])
+        with span('serialize'): return {'model':name,'forecasts':{str(h):[{'date': d, 'pred': y} for d, y in zip(dates[:h], preds[:h])] for h in hs}}
+    dims=[b.strip() for b in (by or '').split(',') if b.strip()]
+    with span('compute'): rows=_series_forecast(dims, hs[-1], store_id, region, category)
+    if isinstance(rows, dict): return rows
+    return {'model':'panel_linear_lags','forecasts':{str(h):[{**{k: v for k, v in r.items() if k!='pred'}, 'pred': r['pred'][:h]} for r in rows] for h in hs}}
 
 from typing import Optional
 
+def _rollups_fresh():
+    # the materialized cube is only trusted if it was written after the last change to transactions
+    if not (STORE.exists("category_rollup") and STORE.exists("store_rollup")): return False
+    tx = storage.signature(STORE.path("transactions"))[0]
+    return min(storage.signature(STORE.path(t))[0] for t in ("category_rollup", "store_rollup")) >= tx
+
 @app.get("/metrics/by_category")
 def by_category(
     date_from: Optional[str] = None,
@@ -73,37 +190,168 @@ def by_category(
     store_id: Optional[int] = None,
     region: Optional[str] = None,
 ):
-    import os, pandas as pd
-    tx = pd.read_csv(os.path.join(DATA, "transactions.csv"), parse_dates=["date"])
-    prod = pd.read_csv(os.path.join(DATA, "products.csv"))
-    stores = pd.read_csv(os.path.join(DATA, "stores.csv"))
-
-    df = tx.merge(prod[["product_id", "category"]], on="product_id", how="left")
-    if store_id is not None:
-        df = df[df["store_id"] == int(store_id)]
-    if region:
-        df = df.merge(stores[["store_id", "region"]], on="store_id", how="left")
-        df = df[df["region"] == region]
-    if date_from:
-        df = df[df["date"] >= pd.to_datetime(date_from)]
-    if date_to:
-        df = df[df["date"] <= pd.to_datetime(date_to)]
-
-    out = (
-        df.groupby("category", as_index=False)["revenue"]
-        .sum()
-        .sort_values("revenue", ascending=False)
-    )
-    return out.to_dict(orient="records")
+    if _rollups_fresh():
+        cat, sto = STORE.get("category_rollup"), STORE.get("store_rollup")
+        with span("compute"):
+            cube = rollup.query(cat, sto, ["category"], date_from, date_to, store_id, region)
+            cube = cube[["category", "revenue"]].sort_values("revenue", ascending=False)
+        with span("serialize"): return cube.to_dict(orient="records")
+
+    # date/store filters and the column projection are pushed down to storage
+    tx = STORE.query("transactions", ["date", "store_id", "product_id", "revenue"], date_from, date_to, store_id)
+    prod = STORE.get("products")
+    stores = STORE.get("stores")
+
+    with span("compute"):
+        df = tx.merge(prod[["product_id", "category"]], on="product_id", how="left")
+        if region:
+            df = df.merge(stores[["store_id", "region"]], on="store_id", how="left")
+            df = df[df["region"] == region]
+
+        out = (
+            df.groupby("category", as_index=False)["revenue"]
+            .sum()
+            .sort_values("revenue", ascending=False)
+        )
+    with span("serialize"): return out.to_dict(orient="records")
+
+@app.get("/metrics/cube")
+def cube(
+    by: str = "category",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    store_id: Optional[int] = None,
+    region: Optional[str] = None,
+    category: Optional[str] = None,
+):
+    """
+    Slice/dice the pre-aggregated sales cube. `by` is a comma-separated list of
+    dimensions (date, month, store_id, region, category); empty gives the grand total.
+    """
+    if not _rollups_fresh():
+        return {"error": "category/store rollups missing or stale; run preprocess_sales.py"}
+    dims = [b.strip() for b in by.split(",") if b.strip()]
+    cat, sto = STORE.get("category_rollup"), STORE.get("store_rollup")
+    with span("compute"):
+        try:
+            out = rollup.query(cat, sto, dims, date_from, date_to, store_id, region, category)
+        except ValueError as e:
+            return {"error": str(e)}
+        if "date" in out: out["date"] = out["date"].dt.strftime("%Y-%m-%d")
+        if dims: out = out.sort_values(dims)
+    with span("serialize"): return out.to_dict(orient="records")
+
+JOBS = JobRunner(os.path.join(MODEL, "jobs"), int(os.environ.get("TRAIN_MAX_CONCURRENCY", "1")))
+ARTIFACTS = ["rfm_segments.csv", "rfm_kmeans.joblib", "daily_revenue_lr.joblib", "series_forecasts.joblib", basket.ARTIFACT, "train_report.json"]
+_SWAP_LOCK = threading.Lock()
+
+def _staging(job):
+    return os.path.join(MODEL, ".staging", job["id"])
+
+def _train_cmd(tx, daily):
+    def make(job):
+        # train into a private staging dir, seeded with the artifacts that are updated incrementally
+        staging = _staging(job); os.makedirs(staging, exist_ok=True)
+        for f in (basket.ARTIFACT,):
+            if os.path.exists(os.path.join(MODEL, f)): shutil.copy2(os.path.join(MODEL, f), staging)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_models.py")
+        cmd = [sys.executable, script, "--transactions", tx, "--daily", daily, "--model_out", staging]
+        # per store x category forecasts are trained from the rollup only when it reflects the current transactions
+        return cmd + ["--rollup", STORE.path("category_rollup") if _rollups_fresh() else ""]
+    return make
+
+def _swap_artifacts(job):
+    """Move a finished job's artifacts into MODEL_DIR (os.replace per file) and drop every cached model."""
+    staging = _staging(job)
+    with _SWAP_LOCK:
+        for f in ARTIFACTS:
+            if os.path.exists(os.path.join(staging, f)): os.replace(os.path.join(staging, f), os.path.join(MODEL, f))
+        MODELS.invalidate(); REGISTRY.invalidate()
+        with _BASKET_LOCK: _BASKET.update(version=None, cooc=None)
+
+def _drop_staging(job):
+    # runs after every job, so a failed or crashed run does not leave its partial artifacts behind
+    shutil.rmtree(_staging(job), ignore_errors=True)
+
+def _job_view(job):
+    return {k: job[k] for k in ("id", "status", "returncode", "error", "submitted_at", "started_at", "finished_at", "cmd")}
 
 @app.post("/admin/train")
 def admin_train():
-    import subprocess, sys, os
-    tx = os.path.join(DATA, "transactions.csv")
-    daily = os.path.join(DATA, "daily_sales.csv")
-    cmd = [sys.executable, "src/train_models.py", "--transactions", tx, "--daily", daily, "--model_out", MODEL]
-    p = subprocess.run(cmd, capture_output=True, text=True)
-    return {"ok": p.returncode == 0, "stdout": p.stdout[-500:], "stderr": p.stderr[-500:]}
+    """Queue a training run and return its job id immediately; identical in-flight runs are shared."""
+    tx = STORE.path("transactions")
+    daily = STORE.path("daily_sales")
+    job, dedup = JOBS.submit(("train", tx, daily, MODEL), _train_cmd(tx, daily), on_success=_swap_artifacts, on_finish=_drop_staging)
+    return {"ok": True, "job_id": job["id"], "status": job["status"], "deduplicated": dedup}
+
+@app.get("/admin/jobs")
+def admin_jobs():
+    return {"jobs": [_job_view(j) for j in JOBS.list()]}
+
+@app.get("/admin/jobs/{job_id}")
+def admin_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None: return {"error": f"unknown job {job_id}"}
+    return _job_view(job)
+
+@app.get("/admin/jobs/{job_id}/log")
+def admin_job_log(job_id: str, tail: int = 4000):
+    text = JOBS.log(job_id, tail)
+    if text is None: return {"error": f"no log for job {job_id}"}
+    return {"id": job_id, "log": text}
+
+@app.get("/admin/cache")
+def admin_cache():
+    """Hit/miss/reload/eviction counters and resident tables for the dataset caches."""
+    return {"data": STORE.stats(), "models": MODELS.stats(), "registry": REGISTRY.stats(), "forecast_paths": len(_FORECASTS)}
+
+@app.post("/admin/cache/clear")
+def admin_cache_clear():
+    STORE.invalidate(); MODELS.invalidate(); REGISTRY.invalidate()
+    with _FORECAST_LOCK: _FORECASTS.clear()
+    with _ANOMALY_LOCK: _ANOMALY.update(version=None, state=None)
+    return {"ok": True}
+
+# the data tables (STORE), model tables (MODELS) and registry models each GET endpoint reads
+SOURCES = {
+    "/metrics/overview": {"data": ["daily_sales"]},
+    "/metrics/daily": {"data": ["daily_sales"]},
+    "/alerts/anomalies": {"data": [spec["table"] for spec in anomaly.LEVELS.values()]},
+    "/rfm/segments": {"models": ["rfm_segments"]},
+    "/rfm/summary": {"models": ["rfm_segments"]},
+    "/basket/top_pairs": {"data": ["transactions"]},
+    "/forecast/daily": {"data": ["daily_sales"], "registry": ["daily_revenue_lr"]},
+    "/forecast/series": {"registry": ["series_forecasts"]},
+    "/forecast/batch": {"data": ["daily_sales"], "registry": ["daily_revenue_lr", "series_forecasts"]},
+    "/metrics/by_category": {"data": ["transactions", "products", "stores", "category_rollup", "store_rollup"]},
+    "/metrics/cube": {"data": ["transactions", "category_rollup", "store_rollup"]},
+}
+
+@app.get("/version")
+def version():
+    """Per-endpoint version tokens; a token changes only when a table or model that endpoint reads changes (file stats, no reads)."""
+    def token(src):
+        parts = [STORE.version(*src["data"])] if src.get("data") else []
+        if src.get("models"): parts.append(MODELS.version(*src["models"]))
+        parts += [REGISTRY.version(n) or "-" for n in src.get("registry", [])]
+        return "-".join(parts)
+    return {"endpoints": {path: token(src) for path, src in SOURCES.items()}}
+
+@app.get("/metrics/internal")
+def metrics_internal():
+    """Prometheus text exposition: request and span latency histograms, request counts and cache counters."""
+    caches = {(("cache", c), ("event", k)): st[k] for c, st in (("data", STORE.stats()), ("models", MODELS.stats()), ("registry", REGISTRY.stats()))
+              for k in ("hits", "misses", "reloads", "evictions", "loads") if k in st}
+    gauges = {"api_cache_events": ("Cache hit/miss/reload/eviction counters since start.", caches),
+              "api_forecast_paths": ("Cached forecast paths.", {(): len(_FORECASTS)})}
+    return PlainTextResponse(instrument.METRICS.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles/{profile_id}")
+def admin_profile(profile_id: str):
+    """Folded stacks of a profiled request (see X-Profile / API_PROFILE_RATE); feed to flamegraph.pl or speedscope."""
+    text = instrument.read_profile(PROFILES, profile_id)
+    if text is None: return {"error": f"no profile {profile_id}"}
+    return PlainTextResponse(text)
 
 from typing import Optional
 
@@ -113,54 +361,54 @@ def rfm_summary():
     Returns per-segment medians of Recency / Frequency / Monetary, counts,
     and a simple auto label for each segment.
     """
-    import os, pandas as pd
-    p = os.path.join(MODEL, "rfm_segments.csv")
-    if not os.path.exists(p):
+    if not MODELS.exists("rfm_segments"):
         return {"error": "no rfm_segments.csv found; run /admin/train or train_models.py"}
 
-    df = pd.read_csv(p)
-
-    # Per-segment medians + counts
-    med = (
-        df.groupby("segment")
-          .agg(
-              recency=("recency", "median"),
-              frequency=("frequency", "median"),
-              monetary=("monetary", "median"),
-              count=("customer_id", "count"),
-          )
-          .reset_index()
-    )
-
-    # Quantiles over the whole customer set to define bins (3-level)
-    r33, r66 = df["recency"].quantile([0.33, 0.66]).tolist()
-    f33, f66 = df["frequency"].quantile([0.33, 0.66]).tolist()
-    m33, m66 = df["monetary"].quantile([0.33, 0.66]).tolist()
-
-    def label_row(r, f, m):
-        # recency: lower is better (more recent)
-        rcat = "new" if r <= r33 else ("warm" if r <= r66 else "stale")
-        fcat = "high" if f > f66 else ("mid" if f > f33 else "low")
-        mcat = "high" if m > m66 else ("mid" if m > m33 else "low")
-
-        # simple, readable names
-        if rcat == "new" and fcat == "high" and mcat == "high":
-            return "Loyal / Champions"
-        if rcat == "stale" and (fcat != "high" or mcat != "high"):
-            return "At-risk / Churn-prone"
-        if rcat == "new" and (fcat == "low" or mcat == "low"):
-            return "New / Onboarding"
-        if fcat == "high" or mcat == "high":
-            return "Potential Loyalists"
-        return "Regular"
-
-    med["label"] = med.apply(
-        lambda r: label_row(r["recency"], r["frequency"], r["monetary"]), axis=1
-    )
+    df = MODELS.get("rfm_segments")
+
+    with span("compute"):
+        # Per-segment medians + counts
+        med = (
+            df.groupby("segment")
+              .agg(
+                  recency=("recency", "median"),
+                  frequency=("frequency", "median"),
+                  monetary=("monetary", "median"),
+                  count=("customer_id", "count"),
+              )
+              .reset_index()
+        )
+
+        # Quantiles over the whole customer set to define bins (3-level)
+        r33, r66 = df["recency"].quantile([0.33, 0.66]).tolist()
+        f33, f66 = df["frequency"].quantile([0.33, 0.66]).tolist()
+        m33, m66 = df["monetary"].quantile([0.33, 0.66]).tolist()
+
+        def label_row(r, f, m):
+            # recency: lower is better (more recent)
+            rcat = "new" if r <= r33 else ("warm" if r <= r66 else "stale")
+            fcat = "high" if f > f66 else ("mid" if f > f33 else "low")
+            mcat = "high" if m > m66 else ("mid" if m > m33 else "low")
+
+            # simple, readable names
+            if rcat == "new" and fcat == "high" and mcat == "high":
+                return "Loyal / Champions"
+            if rcat == "stale" and (fcat != "high" or mcat != "high"):
+                return "At-risk / Churn-prone"
+            if rcat == "new" and (fcat == "low" or mcat == "low"):
+                return "New / Onboarding"
+            if fcat == "high" or mcat == "high":
+                return "Potential Loyalists"
+            return "Regular"
+
+        med["label"] = med.apply(
+            lambda r: label_row(r["recency"], r["frequency"], r["monetary"]), axis=1
+        )
 
     # Return tidy rows
-    return {
-        "summary": med.sort_values("segment")[
-            ["segment", "count", "recency", "frequency", "monetary", "label"]
-        ].to_dict(orient="records")
-    }
+    with span("serialize"):
+        return {
+            "summary": med.sort_values("segment")[
+                ["segment", "count", "recency", "frequency", "monetary", "label"]
+            ].to_dict(orient="records")
+        }
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Sparse product co-occurrence engine for basket analysis.
+
+Line items are turned into an order x (partition, product) incidence matrix,
+where a partition is one (date, store_id). Because every order sits in exactly
+one partition, X.T @ X is block diagonal and its upper triangle holds the pair
+counts for every partition in a single sparse product. The partitioned counts
+are persisted so date/store filters are answered by summing rows, and appended
+transactions only add new partitions' worth of counts.
+"""
+import argparse, os, tempfile
+import numpy as np, pandas as pd, joblib
+from scipy import sparse
+import storage
+
+ARTIFACT = 'basket_cooc.joblib'
+KEYS = ['date', 'store_id']
+
+
+def _partition_counts(tx):
+    """Pair / item / order counts per (date, store_id) for the given line items."""
+    li = tx[['order_id', 'date', 'store_id', 'product_id']].drop_duplicates(['order_id', 'product_id'])
+    li = li.assign(date=pd.to_datetime(li['date']).dt.floor('D'))
+    if li.empty:
+        return (pd.DataFrame(columns=KEYS + ['p1', 'p2', 'count']), pd.DataFrame(columns=KEYS + ['product_id', 'orders']),
+                pd.DataFrame(columns=KEYS + ['orders']))
+    part, part_idx = np.unique(li[KEYS].to_records(index=False), return_inverse=True)
+    gp = np.stack([part_idx.ravel(), li['product_id'].to_numpy()], axis=1)
+    cols, col_idx = np.unique(gp, axis=0, return_inverse=True)
+    _, row_idx = np.unique(li['order_id'].to_numpy(), return_inverse=True)
+    X = sparse.csr_matrix((np.ones(len(li), dtype=np.int32), (row_idx.ravel(), col_idx.ravel())), shape=(row_idx.max() + 1, len(cols)))
+    C = (X.T @ X).tocoo()
+    items = C.row == C.col; upper = C.row < C.col
+
+    part = pd.DataFrame.from_records(part)
+    def _frame(rows, extra):
+        f = part.iloc[cols[rows, 0]].reset_index(drop=True)
+        for k, v in extra.items(): f[k] = v
+        return f
+    pairs = _frame(C.row[upper], {'p1': cols[C.row[upper], 1], 'p2': cols[C.col[upper], 1], 'count': C.data[upper].astype(np.int64)})
+    item_counts = _frame(C.row[items], {'product_id': cols[C.row[items], 1], 'orders': C.data[items].astype(np.int64)})
+    orders = li.groupby(KEYS, as_index=False)['order_id'].nunique().rename(columns={'order_id': 'orders'})
+    return pairs, item_counts, orders
+
+
+def _combine(frames, keys, value):
+    return pd.concat(frames, ignore_index=True).groupby(keys, as_index=False)[value].sum()
+
+
+def _with_totals(cooc):
+    # all-time pair ranking, so unfiltered queries are a head() instead of a groupby
+    ranked = cooc['pairs'].groupby(['p1', 'p2'], as_index=False)['count'].sum()
+    cooc['all_pairs'] = ranked.sort_values(['count', 'p1', 'p2'], ascending=[False, True, True], ignore_index=True)
+    return cooc
+
+
+def build(tx):
+    """Full build from a transactions frame."""
+    pairs, items, orders = _partition_counts(tx)
+    return _with_totals({'pairs': pairs, 'items': items, 'orders': orders,
+                         'max_order_id': int(tx['order_id'].max()) if len(tx) else 0, 'rows': len(tx), 'fingerprint': _fingerprint(tx)})
+
+
+def _fingerprint(tx):
+    return storage.fingerprint(tx[['order_id', 'date', 'store_id', 'product_id']])
+
+
+def update(cooc, tx):
+    """Fold transactions appended since `cooc` was built into it.
+
+    New orders are those with ids above the last build's maximum. The rows at
+    or below it must be exactly the rows already counted (same count and
+    content fingerprint); if they were removed or rewritten, e.g. by a
+    regenerated file, this falls back to a full build.
+    """
+    if cooc is None: return build(tx)
+    seen = tx['order_id'] <= cooc['max_order_id']; old = tx[seen]
+    if len(old) != cooc['rows'] or _fingerprint(old) != cooc.get('fingerprint'): return build(tx)
+    new = tx[~seen]
+    if new.empty: return cooc
+    pairs, items, orders = _partition_counts(new)
+    return _with_totals({'pairs': _combine([cooc['pairs'], pairs], KEYS + ['p1', 'p2'], 'count'),
+                         'items': _combine([cooc['items'], items], KEYS + ['product_id'], 'orders'),
+                         'orders': _combine([cooc['orders'], orders], KEYS, 'orders'),
+                         'max_order_id': int(tx['order_id'].max()), 'rows': len(tx),
+                         'fingerprint': (cooc['fingerprint'] + _fingerprint(new)) % (1 << 64)})
+
+
+def _filter(df, date_from=None, date_to=None, store_id=None):
+    if date_from: df = df[df['date'] >= pd.to_datetime(date_from)]
+    if date_to: df = df[df['date'] <= pd.to_datetime(date_to)]
+    if store_id is not None: df = df[df['store_id'] == int(store_id)]
+    return df
+
+
+def top_pairs(cooc, n=10, date_from=None, date_to=None, store_id=None):
+    """Top-n pairs by count with support, both confidences and lift."""
+    flt = dict(date_from=date_from, date_to=date_to, store_id=store_id)
+    if date_from or date_to or store_id is not None:
+        pairs = _filter(cooc['pairs'], **flt).groupby(['p1', 'p2'], as_index=False)['count'].sum()
+        top = pairs.sort_values(['count', 'p1', 'p2'], ascending=[False, True, True]).head(n)
+    else:
+        top = cooc['all_pairs'].head(n)
+    if top.empty: return []
+    item_orders = _filter(cooc['items'], **flt).groupby('product_id')['orders'].sum()
+    n_orders = max(1, int(_filter(cooc['orders'], **flt)['orders'].sum()))
+    o1 = item_orders.reindex(top['p1']).to_numpy(float); o2 = item_orders.reindex(top['p2']).to_numpy(float); c = top['count'].to_numpy(float)
+    top = top.assign(support=c / n_orders, conf_p1_p2=c / o1, conf_p2_p1=c / o2, lift=c * n_orders / (o1 * o2))
+    return top.astype({'p1': int, 'p2': int, 'count': int}).to_dict(orient='records')
+
+
+def load(model_dir):
+    p = os.path.join(model_dir, ARTIFACT)
+    return joblib.load(p) if os.path.exists(p) else None
+
+
+def save(cooc, model_dir):
+    os.makedirs(model_dir, exist_ok=True); p = os.path.join(model_dir, ARTIFACT)
+    fd, tmp = tempfile.mkstemp(prefix=ARTIFACT + '.', suffix='.tmp', dir=model_dir); os.close(fd)
+    try: joblib.dump(cooc, tmp); os.replace(tmp, p)
+    except BaseException: os.remove(tmp); raise
+
+
+def build_basket(tx_csv, model_out, incremental=True):
+    tx = storage.read(tx_csv, columns=['order_id', 'date', 'store_id', 'product_id'])
+    cooc = update(load(model_out) if incremental else None, tx); save(cooc, model_out)
+    print(f"Saved basket co-occurrence ({len(cooc['pairs'])} partitioned pairs)"); return cooc
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(); ap.add_argument('--transactions', default='data/raw/transactions.csv'); ap.add_argument('--model_out', default='models')
+    ap.add_argument('--full', action='store_true', help='rebuild from scratch instead of folding in appended orders')
+    a = ap.parse_args(); build_basket(a.transactions, a.model_out, incremental=not a.full)
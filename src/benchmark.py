@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Benchmark the batch pipeline and load-test the API on synthetic datasets.
+
+For each dataset size the seeded generator writes `<work_dir>/<size>/data/raw`
+(reused on later runs unless `--regenerate`). Then:
+
+- Every pipeline step runs in a fresh process and reports wall-clock seconds,
+  peak RSS and RSS growth, using the same `stage` timer as train_models.py
+  (nested sub-stages are reported too). RSS covers the step's own process, not
+  the worker pools it starts.
+- Every GET endpoint without path parameters is driven through an in-process
+  TestClient from `--concurrency` threads: a cold first request, then
+  `--requests` timed requests. Each endpoint reports throughput, p50/p95/p99
+  latency and its error count.
+
+Results go to `--out` as JSON. With `--baseline old.json`, steps and endpoints
+whose time grew by more than `--tolerance` are listed.
+"""
+import argparse, importlib.util, json, os, platform, subprocess, sys, threading, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# order volume follows days x stores (~1.5 orders per store-day), so that is what the sizes scale
+SIZES = {
+    'small': dict(days=60, customers=500, products=60, stores=4),          # ~1k line items
+    'medium': dict(days=180, customers=20_000, products=300, stores=100),  # ~50k
+    'large': dict(days=365, customers=200_000, products=1_000, stores=1_000),  # ~1M
+}
+# query strings for the load test; endpoints not listed are called without parameters
+PARAMS = {
+    '/metrics/overview': {'date_from': '2025-01-15'},
+    '/metrics/daily': {'date_from': '2025-01-15'},
+    '/basket/top_pairs': {'n': 10},
+    '/alerts/anomalies': {'z': 2.5},
+    '/forecast/daily': {'h': 14},
+    '/forecast/series': {'h': 14, 'by': 'region'},
+    '/metrics/cube': {'by': 'month,region'},
+}
+
+
+def _step(target, args, kwargs):
+    # runs in a fresh process so the high-water RSS belongs to this step alone
+    import importlib, train_models
+    mod, fn = target.split(':')
+    with train_models.stage(target): getattr(importlib.import_module(mod), fn)(*args, **kwargs)
+    return train_models.STAGES
+
+
+def run_step(name, target, *args, **kwargs):
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as ex:
+        stages = ex.submit(_step, target, args, kwargs).result()
+    top = stages[-1]
+    return {**top, 'stage': name, 'target': target, 'substages': stages[:-1]}
+
+
+def pipeline(size, raw, models, regenerate=False, workers=None):
+    p = lambda t: os.path.join(raw, f'{t}.csv')
+    steps = []
+    if regenerate or not os.path.exists(p('transactions')):
+        steps.append(run_step('simulate', 'simulate_retail:simulate', os.path.dirname(raw), '2025-01-01', seed=0, images=False, workers=workers, **SIZES[size]))
+    if os.path.exists(os.path.join(raw, 'anomaly_state.joblib')): os.remove(os.path.join(raw, 'anomaly_state.joblib'))  # time a full scan
+    os.makedirs(models, exist_ok=True)
+    steps += [
+        run_step('preprocess', 'preprocess_sales:preprocess', p('transactions'), p('visits'), p('daily_sales')),
+        run_step('rollups', 'rollup:build_rollups', p('transactions'), p('products'), p('stores'), raw, incremental=False),
+        run_step('anomaly', 'anomaly:update', raw),
+        run_step('build_rfm', 'train_models:build_rfm', p('transactions'), os.path.join(models, 'rfm_segments.csv')),
+        run_step('build_forecast', 'train_models:build_forecast', p('daily_sales'), models),
+        run_step('build_series_forecasts', 'train_models:build_series_forecasts', p('category_rollup'), models, workers=workers),
+        run_step('build_basket', 'basket:build_basket', p('transactions'), models, incremental=False),
+    ]
+    return steps
+
+
+def _load_api(raw, models, tag):
+    # a private module instance per dataset: api.py reads DATA_DIR / MODEL_DIR at import
+    os.environ['DATA_DIR'] = raw; os.environ['MODEL_DIR'] = models
+    spec = importlib.util.spec_from_file_location(f'api_bench_{tag}', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api.py'))
+    mod = importlib.util.module_from_spec(spec); spec.loader.exec_module(mod)
+    return mod
+
+
+def load_test(app, concurrency=8, n_requests=200):
+    from fastapi.routing import APIRoute
+    from fastapi.testclient import TestClient
+    local = threading.local()
+    def client():
+        if not hasattr(local, 'c'): local.c = TestClient(app)
+        return local.c
+    def call(path, params):
+        t0 = time.perf_counter(); r = client().get(path, params=params); dt = time.perf_counter() - t0
+        # only JSON bodies can carry an {'error': ...}; text endpoints such as /metrics/internal are checked by status
+        body = r.json() if r.headers.get('content-type', '').startswith('application/json') else None
+        return dt, r.status_code < 400 and not (isinstance(body, dict) and 'error' in body)
+    out, skipped = {}, []
+    for path in sorted({r.path for r in app.routes if isinstance(r, APIRoute) and 'GET' in r.methods}):
+        if '{' in path: skipped.append(path); continue
+        params = PARAMS.get(path, {}); cold, cold_ok = call(path, params)
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            t0 = time.perf_counter(); res = list(ex.map(lambda _: call(path, params), range(n_requests))); wall = time.perf_counter() - t0
+        lat = np.array([r[0] for r in res]) * 1000
+        out[path] = {'params': params, 'cold_ms': round(cold * 1000, 2), 'requests': n_requests, 'concurrency': concurrency,
+                     'throughput_rps': round(n_requests / wall, 1), 'errors': int(sum(not r[1] for r in res)) + (not cold_ok),
+                     **{f'p{q}_ms': round(float(np.percentile(lat, q)), 2) for q in (50, 95, 99)}}
+        print(f"  {path:28s} {out[path]['throughput_rps']:8.1f} req/s  p50 {out[path]['p50_ms']:7.2f}  p95 {out[path]['p95_ms']:7.2f}  p99 {out[path]['p99_ms']:7.2f} ms"
+              + (f"  errors {out[path]['errors']}" if out[path]['errors'] else ''))
+    return {'endpoints': out, 'skipped': skipped}
+
+
+def _meta():
+    try: commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: commit = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """(name, old, new) for pipeline steps (seconds) and endpoints (p95 ms) that got slower by more than `tolerance`."""
+    worse = []
+    for size, cur in results['sizes'].items():
+        old = baseline.get('sizes', {}).get(size)
+        if not old: continue
+        prev = {s['stage']: s['seconds'] for s in old.get('pipeline', [])}
+        for s in cur.get('pipeline', []):
+            if s['stage'] in prev and s['seconds'] > prev[s['stage']] * (1 + tolerance): worse.append((f"{size} {s['stage']} s", prev[s['stage']], s['seconds']))
+        prev = old.get('api', {}).get('endpoints', {})
+        for path, e in cur.get('api', {}).get('endpoints', {}).items():
+            if path in prev and e['p95_ms'] > prev[path]['p95_ms'] * (1 + tolerance): worse.append((f"{size} {path} p95 ms", prev[path]['p95_ms'], e['p95_ms']))
+    return worse
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--sizes', default='small,medium', help=f"comma list of {', '.join(SIZES)}")
+    ap.add_argument('--work_dir', default='bench'); ap.add_argument('--out', default='bench/results.json')
+    ap.add_argument('--regenerate', action='store_true', help='regenerate datasets that already exist')
+    ap.add_argument('--concurrency', type=int, default=8); ap.add_argument('--requests', type=int, default=200)
+    ap.add_argument('--workers', type=int, default=None, help='process pool size for the generator and series training')
+    ap.add_argument('--skip_pipeline', action='store_true', help='reuse existing data and models; only load-test the API')
+    ap.add_argument('--skip_api', action='store_true')
+    ap.add_argument('--baseline', default=None, help='previous results file to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.2, help='slowdown ratio reported as a regression')
+    a = ap.parse_args()
+    results = {'meta': _meta(), 'sizes': {}}
+    for size in [s.strip() for s in a.sizes.split(',') if s.strip()]:
+        if size not in SIZES: sys.exit(f"unknown size {size!r}; choose from {list(SIZES)}")
+        raw = os.path.abspath(os.path.join(a.work_dir, size, 'data', 'raw')); models = os.path.abspath(os.path.join(a.work_dir, size, 'models'))
+        print(f"== {size}: {SIZES[size]}"); entry = results['sizes'][size] = {'dataset': SIZES[size]}
+        if not a.skip_pipeline: entry['pipeline'] = pipeline(size, raw, models, a.regenerate, a.workers)
+        entry['rows'] = {t: sum(1 for _ in open(os.path.join(raw, f'{t}.csv'))) - 1 for t in ('transactions', 'daily_sales', 'customers') if os.path.exists(os.path.join(raw, f'{t}.csv'))}
+        if not a.skip_api: entry['api'] = load_test(_load_api(raw, models, size).app, a.concurrency, a.requests)
+    os.makedirs(os.path.dirname(os.path.abspath(a.out)), exist_ok=True)
+    with open(a.out, 'w') as f: json.dump(results, f, indent=1)
+    print(f"Wrote {a.out}")
+    if a.baseline:
+        with open(a.baseline) as f: worse = compare(results, json.load(f), a.tolerance)
+        for name, old, new in worse: print(f"REGRESSION {name}: {old} -> {new}")
+        if not worse: print(f"No regressions beyond {a.tolerance:.0%}")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""In-process cache for the tables served by the API.
+
+Each table is read once through `storage` (CSV or Parquet, dates parsed) and
+kept in memory until its file's or dataset's mtime or size changes, it is invalidated explicitly, or it is evicted to stay
+under the memory budget. Cached frames are shared between requests, so callers
+must copy before mutating them.
+"""
+import hashlib, os, threading
+from collections import OrderedDict
+import pandas as pd
+import storage
+from instrument import span
+
+# table name -> optional fixed file name (else resolved by storage.table_path) + sort key applied once at load
+DATA_TABLES = {
+    'daily_sales': {'sort': 'date'},
+    'transactions': {},
+    'products': {},
+    'stores': {},
+    'customers': {},
+    'visits': {},
+    'category_rollup': {},
+    'store_rollup': {},
+}
+MODEL_TABLES = {
+    'rfm_segments': {'file': 'rfm_segments.csv'},
+}
+DEFAULT_BUDGET_MB = float(os.environ.get('DATASET_CACHE_MB', '512'))
+
+
+class DatasetStore:
+    """LRU cache of parsed tables under `base_dir`, bounded by `max_mb` of frame memory."""
+
+    def __init__(self, base_dir, tables, max_mb=DEFAULT_BUDGET_MB):
+        self.base_dir = base_dir; self.tables = dict(tables)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()  # name -> (signature, frame, nbytes)
+        self._lock = threading.RLock()
+        self._loading = {}  # name -> lock held while that table is parsed
+        self.counters = {'hits': 0, 'misses': 0, 'reloads': 0, 'evictions': 0}
+
+    def path(self, name):
+        spec = self.tables[name]
+        return os.path.join(self.base_dir, spec['file']) if 'file' in spec else storage.table_path(self.base_dir, name)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def get(self, name):
+        """Return the parsed table, reloading it if the file changed on disk.
+
+        Raises FileNotFoundError when the file is missing.
+        """
+        with span('load'): return self._get(name)
+
+    def _cached(self, name, sig):
+        # caller holds self._lock
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == sig:
+            self._entries.move_to_end(name); self.counters['hits'] += 1
+            return entry[1]
+        return None
+
+    def _get(self, name):
+        path = self.path(name); sig = storage.signature(path)
+        with self._lock:
+            df = self._cached(name, sig)
+            if df is not None: return df
+            loading = self._loading.setdefault(name, threading.Lock())
+        # parse outside the cache lock so hits on other tables are not blocked;
+        # the per-table lock makes concurrent misses on one table wait for a single load
+        with loading:
+            with self._lock:
+                df = self._cached(name, sig)
+                if df is not None: return df
+                self.counters['reloads' if name in self._entries else 'misses'] += 1
+            df = self._load(name, path)
+            nbytes = int(df.memory_usage(deep=True).sum())
+            with self._lock:
+                self._entries.pop(name, None)
+                if nbytes <= self.max_bytes:
+                    self._entries[name] = (sig, df, nbytes); self._evict()
+            return df
+
+    def _load(self, name, path):
+        spec = self.tables[name]
+        df = storage.read(path)
+        if spec.get('sort'): df = df.sort_values(spec['sort']).reset_index(drop=True)
+        return df
+
+    def query(self, name, columns=None, date_from=None, date_to=None, store_id=None):
+        """Filtered, projected read: pushed down to Parquet, else served from the cached frame."""
+        path = self.path(name)
+        if isinstance(storage.backend_for(path), storage.ParquetBackend):
+            with span('load'): return storage.read(path, columns, date_from, date_to, store_id)
+        df = self.get(name)
+        if date_from: df = df[df['date'] >= pd.to_datetime(date_from)]
+        if date_to: df = df[df['date'] <= pd.to_datetime(date_to)]
+        if store_id is not None: df = df[df['store_id'] == int(store_id)]
+        return df if columns is None else df[list(columns)]
+
+    def _evict(self):
+        while sum(e[2] for e in self._entries.values()) > self.max_bytes and len(self._entries) > 1:
+            self._entries.popitem(last=False); self.counters['evictions'] += 1
+
+    def invalidate(self, name=None):
+        """Drop one table (or every table) so the next `get` re-reads it."""
+        with self._lock:
+            if name is None: self._entries.clear()
+            else: self._entries.pop(name, None)
+
+    def version(self, *names):
+        """Token that changes whenever any of the named tables (default: all) changes on disk."""
+        parts = []
+        for name in (names or sorted(self.tables)):
+            p = self.path(name)
+            parts.append(f"{name}:{'%d-%d' % storage.signature(p) if os.path.exists(p) else '-'}")
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters,
+                    'tables': {n: {'bytes': e[2], 'mtime_ns': e[0][0], 'size': e[0][1]} for n, e in self._entries.items()},
+                    'bytes': sum(e[2] for e in self._entries.values()), 'max_bytes': self.max_bytes}
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Recursive lag-feature forecasting, batched across series.
+
+The daily models predict revenue from [t, lag1, lag7]. Each horizon step feeds
+its prediction back as lag1, so steps are inherently sequential, but every
+series is advanced together: one `predict` call per step for all series,
+instead of one per step per series. Shorter horizons are prefixes of longer
+ones, so a single path at the largest horizon answers every horizon.
+"""
+import numpy as np
+
+
+def recursive_forecast(predict, last_t, lag1, lag7, h):
+    """Predictions of shape (n_series, h) from per-series arrays of the last t, lag1 and lag7.
+
+    `predict` maps an (n_series, 3) feature matrix to n_series predictions,
+    e.g. a fitted model's `predict` or `panel_predict(coef, intercept)`.
+    """
+    last_t = np.asarray(last_t, float); lag1 = np.array(lag1, float); lag7 = np.array(lag7, float)
+    out = np.empty((len(lag1), h))
+    for i in range(1, h + 1):
+        y = predict(np.column_stack([last_t + i, lag1, lag7]))
+        out[:, i - 1] = y
+        if i >= 6: lag7 = lag1
+        lag1 = y
+    return out
+
+
+def lag_state(revenue):
+    """(last_t, lag1, lag7) for one series of daily revenue ordered by date."""
+    r = np.asarray(revenue, float)
+    return len(r) - 1, r[-1], (r[-7] if len(r) >= 7 else r[0])
+
+
+def panel_predict(coef, intercept):
+    """Row-wise linear predictor for per-series coefficients (n_series, 3) and intercepts (n_series,)."""
+    return lambda X: np.einsum('ij,ij->i', X, coef) + intercept
+
+
+def fit_panel(Y, ridge=1e-6):
+    """Least-squares [t, lag1, lag7] -> y fits for every row of a (n_series, n_days) matrix at once.
+
+    Solves the 4x4 normal equations of all series in one batched call; returns
+    (coef (n_series, 3), intercept (n_series,)).
+    """
+    Y = np.asarray(Y, float); S, T = Y.shape
+    t = np.broadcast_to(np.arange(7, T, dtype=float), (S, T - 7))
+    X = np.stack([t, Y[:, 6:T - 1], Y[:, :T - 7], np.ones((S, T - 7))], axis=2)  # (S, n, 4)
+    y = Y[:, 7:]
+    A = np.einsum('snk,snl->skl', X, X) + ridge * np.eye(4); b = np.einsum('snk,sn->sk', X, y)
+    w = np.linalg.solve(A, b[..., None])[..., 0]
+    return w[:, :3], w[:, 3]
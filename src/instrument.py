@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Request instrumentation for the API: latency histograms, timed spans and an opt-in sampling profiler.
+
+- `InstrumentMiddleware` (pure ASGI) times every request. Samples are labelled
+  by route template, e.g. `/admin/jobs/{job_id}`, so label cardinality stays
+  bounded.
+- `span(name)` times one phase of a handler: `load`, `model_load`, `compute`,
+  `serialize` or `encode`. Spans record self time: a `load` nested inside a
+  `compute` is not counted twice. Whatever the spans do not cover is recorded
+  as `other` (routing, validation, middleware). The request's spans are also
+  sent to clients in a `Server-Timing` header.
+- `METRICS.render()` gives the Prometheus text exposition.
+- Profiling is enabled per request with an `X-Profile: 1` header, or for a
+  random fraction of requests with `API_PROFILE_RATE`. A sampler thread reads
+  the request's threads' stacks every `API_PROFILE_INTERVAL_MS` (default 5)
+  and writes them in folded-stack format (`frame;frame;frame count`), which
+  flamegraph.pl and speedscope read directly. The file goes under the profile
+  directory, and its id is returned in `X-Profile-Id`.
+"""
+import contextvars, os, random, sys, threading, time, uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_CTX = contextvars.ContextVar('request_ctx', default=None)
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets; self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: [[0] * len(buckets), 0.0, 0])  # (route, method) -> [bucket counts, sum, count]
+        self.spans = defaultdict(lambda: [[0] * len(buckets), 0.0, 0])    # (route, span)
+        self.requests = Counter()                                           # (route, method, status)
+
+    def _observe(self, hist, key, seconds):
+        h = hist[key]; h[1] += seconds; h[2] += 1
+        for i, b in enumerate(self.buckets):
+            if seconds <= b: h[0][i] += 1; break
+
+    def observe(self, route, method, status, seconds, spans):
+        with self._lock:
+            self._observe(self.latency, (route, method), seconds); self.requests[(route, method, str(status))] += 1
+            for name, dt in spans.items(): self._observe(self.spans, (route, name), dt)
+
+    def reset(self):
+        with self._lock: self.latency.clear(); self.spans.clear(); self.requests.clear()
+
+    def render(self, gauges=None):
+        """Prometheus text format; `gauges` adds `{name: (help, {labels-tuple: value})}` families."""
+        out = []
+        def hist(name, help_, data, labels):
+            out.extend([f'# HELP {name} {help_}', f'# TYPE {name} histogram'])
+            for key, (counts, total, n) in sorted(data.items()):
+                lbl = _labels(zip(labels, key)); cum = 0
+                for b, c in zip(self.buckets, counts):
+                    cum += c; out.append(f'{name}_bucket{{{lbl},le="{b}"}} {cum}')
+                out.extend([f'{name}_bucket{{{lbl},le="+Inf"}} {n}', f'{name}_sum{{{lbl}}} {total:.6f}', f'{name}_count{{{lbl}}} {n}'])
+        with self._lock:
+            hist('api_request_duration_seconds', 'Request latency by route.', self.latency, ('route', 'method'))
+            hist('api_span_duration_seconds', 'Self time of handler phases by route.', self.spans, ('route', 'span'))
+            out += ['# HELP api_requests_total Requests by route and status.', '# TYPE api_requests_total counter']
+            out += [f'api_requests_total{{route="{r}",method="{m}",status="{s}"}} {n}' for (r, m, s), n in sorted(self.requests.items())]
+        for name, (help_, values) in (gauges or {}).items():
+            out += [f'# HELP {name} {help_}', f'# TYPE {name} gauge']
+            out += [f'{name}{{{_labels(labels)}}} {val}' if labels else f'{name} {val}' for labels, val in values.items()]
+        return '\n'.join(out) + '\n'
+
+
+def _labels(pairs):
+    return ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def span(name):
+    """Time a handler phase (self time) for the current request; a no-op outside a request."""
+    ctx = _CTX.get()
+    if ctx is None: yield; return
+    ctx['threads'].add(threading.get_ident())
+    stack = ctx['stack']; stack.append(0.0); t0 = time.perf_counter()
+    try: yield
+    finally:
+        dt = time.perf_counter() - t0; children = stack.pop()
+        ctx['spans'][name] = ctx['spans'].get(name, 0.0) + dt - children
+        if stack: stack[-1] += dt
+
+
+class Sampler(threading.Thread):
+    """Folded stacks of the given threads, sampled every `interval` seconds until stopped."""
+
+    def __init__(self, threads, interval=0.005):
+        super().__init__(daemon=True, name='profile-sampler')
+        self.threads = threads; self.interval = interval; self.stacks = Counter(); self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            for tid in list(self.threads):
+                f = frames.get(tid); stack = []
+                if f is None or f.f_code.co_filename.endswith('selectors.py'): continue  # idle event loop
+                while f is not None:
+                    stack.append(f'{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_lineno})'); f = f.f_back
+                if stack: self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set(); self.join()
+        return ''.join(f'{k} {v}\n' for k, v in self.stacks.items())
+
+
+class InstrumentMiddleware:
+    def __init__(self, app, profile_dir='profiles', profile_rate=0.0, profile_interval=0.005):
+        self.app = app; self.profile_dir = profile_dir; self.rate = profile_rate; self.interval = profile_interval
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http': return await self.app(scope, receive, send)
+        headers = dict(scope.get('headers') or [])
+        ctx = {'spans': {}, 'stack': [], 'threads': {threading.get_ident()}}; token = _CTX.set(ctx)
+        sampler = None; profile_id = None
+        if headers.get(b'x-profile', b'').lower() in (b'1', b'true') or (self.rate and random.random() < self.rate):
+            profile_id = uuid.uuid4().hex[:12]; sampler = Sampler(ctx['threads'], self.interval); sampler.start()
+        status = 500; t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                timing = ', '.join(f'{k};dur={v * 1000:.2f}' for k, v in ctx['spans'].items())
+                extra = [(b'server-timing', f'{timing + ", " if timing else ""}app;dur={(time.perf_counter() - t0) * 1000:.2f}'.encode())]
+                if profile_id: extra.append((b'x-profile-id', profile_id.encode()))
+                message = {**message, 'headers': list(message.get('headers', [])) + extra}
+            await send(message)
+
+        try: await self.app(scope, receive, send_wrapper)
+        finally:
+            total = time.perf_counter() - t0; _CTX.reset(token)
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            spans = dict(ctx['spans']); spans['other'] = max(0.0, total - sum(spans.values()))
+            METRICS.observe(route, scope['method'], status, total, spans)
+            if sampler is not None:
+                folded = sampler.stop(); os.makedirs(self.profile_dir, exist_ok=True)
+                with open(os.path.join(self.profile_dir, f'{profile_id}.folded'), 'w') as f: f.write(folded)
+
+
+def read_profile(profile_dir, profile_id):
+    path = os.path.join(profile_dir, f'{os.path.basename(profile_id)}.folded')
+    if not os.path.exists(path): return None
+    with open(path) as f: return f.read()
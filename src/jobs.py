@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Background job runner for long-running admin tasks such as training.
+
+Each job is a subprocess started from a bounded worker pool, so at most
+`max_concurrency` of them run at once and the API threads never wait on them.
+Submitting a job whose key matches one that is still queued or running returns
+that job instead of starting a duplicate. Output goes to a per-job log file, and
+an optional `on_success` callback runs in the worker once the process exits 0,
+and an optional `on_finish` callback runs after every job however it ended (to
+clean up what `make_cmd` created). Only the `keep` most recent finished jobs,
+and their logs, are retained.
+The command is built by `make_cmd(job)` when the job starts, so it can use the
+job id (e.g. for a per-job staging directory).
+"""
+import os, subprocess, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ACTIVE = ('queued', 'running')
+
+
+class JobRunner:
+    def __init__(self, log_dir, max_concurrency=1, keep=50):
+        self.log_dir = log_dir; self.keep = keep; self.jobs = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='job')
+        self._lock = threading.Lock()
+
+    def submit(self, key, make_cmd, on_success=None, cwd=None, on_finish=None):
+        """Queue a job; returns (job, deduplicated)."""
+        with self._lock:
+            for job in self.jobs.values():
+                if job['key'] == key and job['status'] in ACTIVE: return job, True
+            jid = uuid.uuid4().hex[:12]; os.makedirs(self.log_dir, exist_ok=True)
+            job = {'id': jid, 'key': key, 'cmd': None, 'status': 'queued', 'returncode': None, 'error': None,
+                   'submitted_at': time.time(), 'started_at': None, 'finished_at': None, 'log': os.path.join(self.log_dir, f'{jid}.log')}
+            self.jobs[jid] = job
+        self._pool.submit(self._run, job, make_cmd, on_success, cwd, on_finish)
+        return job, False
+
+    def _run(self, job, make_cmd, on_success, cwd, on_finish):
+        job.update(status='running', started_at=time.time())
+        try:
+            job['cmd'] = make_cmd(job)
+            with open(job['log'], 'w') as log:
+                rc = subprocess.run(job['cmd'], stdout=log, stderr=subprocess.STDOUT, cwd=cwd).returncode
+            job['returncode'] = rc
+            if rc == 0 and on_success: on_success(job)
+            job['status'] = 'succeeded' if rc == 0 else 'failed'
+        except Exception as e:  # a failed swap must not leave the job "running"
+            job.update(status='failed', error=repr(e))
+        finally:
+            try:
+                if on_finish: on_finish(job)
+            except Exception as e:
+                job['error'] = job['error'] or repr(e)
+            job['finished_at'] = time.time(); self._prune()
+
+    def _prune(self):
+        with self._lock:
+            done = sorted((j for j in self.jobs.values() if j['finished_at']), key=lambda j: j['finished_at'])
+            for job in done[:max(0, len(done) - self.keep)]:
+                del self.jobs[job['id']]
+                try: os.remove(job['log'])
+                except OSError: pass
+
+    def get(self, jid):
+        return self.jobs.get(jid)
+
+    def log(self, jid, tail=None):
+        job = self.jobs.get(jid)
+        if job is None or not os.path.exists(job['log']): return None
+        with open(job['log'], errors='replace') as f: text = f.read()
+        return text if tail is None else text[-tail:]
+
+    def list(self):
+        return sorted(self.jobs.values(), key=lambda j: j['submitted_at'], reverse=True)
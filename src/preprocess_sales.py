@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 #!/usr/bin/env python3
-import argparse
+import argparse, os, sys
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import anomaly, storage, rollup
 
 def preprocess(transactions_csv, visits_csv, out_csv):
-    tx = pd.read_csv(transactions_csv, parse_dates=['date'])
-    vs = pd.read_csv(visits_csv, parse_dates=['date'])
+    # inputs/output may be CSV files or Parquet dataset directories (see storage.py)
+    tx = storage.read(transactions_csv, columns=['date', 'order_id', 'revenue', 'quantity'])
+    vs = storage.read(visits_csv, columns=['date', 'visits'])
 
     # ✅ Ensure both keys are datetime64[ns] at day precision
     tx['date'] = pd.to_datetime(tx['date']).dt.floor('D')
@@ -22,14 +26,115 @@ def preprocess(transactions_csv, visits_csv, out_csv):
     out = daily.merge(v_daily, on='date', how='left')
     out['aov'] = out['revenue'] / out['orders'].clip(lower=1)
     out['conversion'] = out['orders'] / out['visits'].clip(lower=1)
-    out.to_csv(out_csv, index=False)
+    storage.write(out, out_csv)
     print(f"Wrote {out_csv} with {len(out)} rows")
 
+# ---- Streaming mode ----
+# Transactions are aggregated block by block into per-day partials. Revenue and
+# units are plain sums; distinct orders are counted per block and corrected when
+# one order's line items straddle a block boundary (last order of a block ==
+# first order of the next). That is exact whenever each order's line items are
+# contiguous and order ids ascend through the file, as exports normally are; the
+# partials record whether that held, and if not the order counts are redone
+# exactly from (date, order_id) pairs in a second pass. Partitioned Parquet input
+# is disjoint by construction (an order has one store and one date), so its
+# files are aggregated independently and only need summing.
+TX_COLUMNS = ['date', 'order_id', 'revenue', 'quantity']
+
+def _block_partial(df, since=None):
+    df = df.assign(date=pd.to_datetime(df['date']).dt.floor('D'))
+    if since is not None: df = df[df['date'] >= since]
+    return storage.order_partial(df, 'date', revenue=('revenue', 'sum'), units=('quantity', 'sum'), orders=('order_id', 'nunique'))
+
+def _fold(a, b):
+    """Combine two partials, `a` preceding `b` in file order."""
+    return storage.fold_partials(a, b, 'sum', 'orders')
+
+def _range_partial(args):
+    path, start, end, since, block_bytes = args; part = None
+    for df in storage.iter_csv_range(path, start, end, TX_COLUMNS, block_bytes):
+        part = _fold(part, _block_partial(df, since))
+    return part
+
+def _file_partial(args):
+    path, since, chunksize = args; part = None
+    for df in storage.iter_chunks(path, TX_COLUMNS, chunksize, since):
+        part = _fold(part, _block_partial(df))
+    return part
+
+def _merge_disjoint(a, b):
+    if a is None or b is None: return a or b
+    return {**a, 'agg': a['agg'].add(b['agg'], fill_value=0), 'ok': a['ok'] and b['ok']}
+
+def _exact_orders(transactions, since, chunksize):
+    pairs = []
+    for df in storage.iter_chunks(transactions, ['date', 'order_id'], chunksize, since):
+        pairs.append(df.assign(date=pd.to_datetime(df['date']).dt.floor('D')).drop_duplicates())
+    return pd.concat(pairs).drop_duplicates().groupby('date')['order_id'].nunique()
+
+def preprocess_streaming(transactions, visits, out, chunksize=1_000_000, workers=None, incremental=False, block_mb=64):
+    """Bounded-memory equivalent of `preprocess`.
+
+    CSV transactions are split into newline-aligned byte ranges parsed in
+    parallel by `workers` processes, `block_mb` at a time; Parquet datasets are
+    streamed file by file, also in parallel, in `chunksize`-row batches. With `incremental`, days before the last
+    day already in `out` are kept as-is and only that day onward is recomputed.
+    """
+    since = None; kept = None
+    if incremental and os.path.exists(out):
+        prev = storage.read(out); prev['date'] = pd.to_datetime(prev['date'])
+        if len(prev): since = prev['date'].max(); kept = prev[prev['date'] < since]
+    workers = workers or os.cpu_count() or 1; part = None
+    if str(transactions).endswith('.csv'):
+        jobs = [(transactions, s, e, since, block_mb << 20) for s, e in storage.csv_byte_ranges(transactions, workers)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for p in ex.map(_range_partial, jobs): part = _fold(part, p)
+    else:
+        jobs = [(f, since, chunksize) for f in storage.parquet_files(transactions)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for p in ex.map(_file_partial, jobs): part = _merge_disjoint(part, p)
+    daily = part['agg'] if part else pd.DataFrame(columns=['revenue', 'units', 'orders'])
+    if part and not part['ok']:
+        print("Order ids are not contiguous/ascending; recounting distinct orders exactly")
+        daily['orders'] = _exact_orders(transactions, since, chunksize)
+    daily = daily.astype({'orders': 'int64', 'units': 'int64'}).rename_axis('date').reset_index()[['date', 'revenue', 'orders', 'units']]
+
+    v_daily = None
+    for df in storage.iter_chunks(visits, ['date', 'visits'], chunksize, since):
+        v = df.assign(date=pd.to_datetime(df['date']).dt.floor('D')).groupby('date')['visits'].sum()
+        v_daily = v if v_daily is None else v_daily.add(v, fill_value=0)
+    v_daily = (v_daily if v_daily is not None else pd.Series(dtype='int64')).astype('int64').rename_axis('date').rename('visits').reset_index()
+
+    res = daily.merge(v_daily, on='date', how='left')
+    res['aov'] = res['revenue'] / res['orders'].clip(lower=1)
+    res['conversion'] = res['orders'] / res['visits'].clip(lower=1)
+    if kept is not None: res = pd.concat([kept, res], ignore_index=True)
+    storage.write(res, out)
+    print(f"Wrote {out} with {len(res)} rows" + (f" (recomputed from {since.date()})" if since is not None else ""))
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("--transactions", default="data/raw/transactions.csv")
     ap.add_argument("--visits", default="data/raw/visits.csv")
     ap.add_argument("--out", default="data/raw/daily_sales.csv")
+    ap.add_argument("--products", default="data/raw/products.csv")
+    ap.add_argument("--stores", default="data/raw/stores.csv")
+    ap.add_argument("--no_rollup", action="store_true", help="skip refreshing the category/store rollups")
+    ap.add_argument("--streaming", action="store_true", help="chunked, bounded-memory aggregation (parallel for CSV input)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="only recompute days from the last day already written (--out with --streaming, and the rollups); "
+                         "for append-only transactions")
+    ap.add_argument("--chunksize", type=int, default=1_000_000)
+    ap.add_argument("--block_mb", type=int, default=64, help="CSV bytes parsed per block per worker")
+    ap.add_argument("--workers", type=int, default=None)
     a = ap.parse_args()
-    preprocess(a.transactions, a.visits, a.out)
+    if a.streaming: preprocess_streaming(a.transactions, a.visits, a.out, a.chunksize, a.workers, a.incremental, a.block_mb)
+    else: preprocess(a.transactions, a.visits, a.out)
+    # rollups and the anomaly state live next to the daily table, in the same format
+    fmt = "csv" if a.out.endswith(".csv") else "parquet"
+    data_dir = os.path.dirname(os.path.normpath(a.out))
+    if fmt == "parquet": data_dir = os.path.dirname(data_dir)
+    if not a.no_rollup and os.path.exists(a.products) and os.path.exists(a.stores):
+        rollup.build_rollups(a.transactions, a.products, a.stores, data_dir, incremental=a.incremental, fmt=fmt)
+    anomaly.update(data_dir, fmt)
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Versioned, in-memory registry for the joblib models under MODEL_DIR.
+
+A model is unpickled once and kept warm; its version is derived from the
+file's mtime and size, so when training swaps in a new artifact the next `get`
+reloads it and callers keyed on the version (e.g. forecast caches) miss.
+"""
+import hashlib, os, threading
+import joblib
+import storage
+from instrument import span
+
+MODELS = {
+    'daily_revenue_lr': 'daily_revenue_lr.joblib',
+    'rfm_kmeans': 'rfm_kmeans.joblib',
+    'series_forecasts': 'series_forecasts.joblib',
+}
+
+
+class ModelRegistry:
+    def __init__(self, model_dir, models=MODELS):
+        self.model_dir = model_dir; self.models = dict(models)
+        self._loaded = {}  # name -> (version, model)
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'loads': 0}
+
+    def path(self, name):
+        return os.path.join(self.model_dir, self.models[name])
+
+    def version(self, name):
+        """Short content-derived version, or None when the artifact does not exist."""
+        p = self.path(name)
+        if not os.path.exists(p): return None
+        return hashlib.sha1(('%d-%d' % storage.signature(p)).encode()).hexdigest()[:12]
+
+    def get(self, name):
+        """(model, version); (None, None) when the artifact does not exist."""
+        with span('model_load'): return self._get(name)
+
+    def _get(self, name):
+        v = self.version(name)
+        if v is None: return None, None
+        with self._lock:
+            cur = self._loaded.get(name)
+            if cur is not None and cur[0] == v:
+                self.counters['hits'] += 1; return cur[1], v
+            model = joblib.load(self.path(name)); self._loaded[name] = (v, model); self.counters['loads'] += 1
+            return model, v
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None: self._loaded.clear()
+            else: self._loaded.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'loaded': {n: v for n, (v, _) in self._loaded.items()}}
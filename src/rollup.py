@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Pre-aggregated sales cube for category / store / region drill-downs.
+
+Two materialized tables are built from the line items at preprocess time:
+
+- `category_rollup`: revenue, units, orders by date x store x category, with
+  the store's region pre-joined.
+- `store_rollup`: the same measures by date x store (region pre-joined).
+
+Revenue and units add up along every axis. An order can span categories, so
+`orders` only adds up along date and store; `query` reads `store_rollup`
+whenever category is neither grouped nor filtered, which keeps order counts exact.
+"""
+import argparse, os, sys
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
+
+DIMENSIONS = ['date', 'month', 'store_id', 'region', 'category']
+MEASURES = ['revenue', 'units', 'orders']
+
+
+def _aggregate(tx, products, stores):
+    tx = tx.assign(date=pd.to_datetime(tx['date']).dt.floor('D')).merge(products[['product_id', 'category']], on='product_id', how='left')
+    tx['category'] = tx['category'].fillna('Unknown')
+    meas = dict(revenue=('revenue', 'sum'), units=('quantity', 'sum'), orders=('order_id', 'nunique'))
+    cat = tx.groupby(['date', 'store_id', 'category'], as_index=False).agg(**meas)
+    sto = tx.groupby(['date', 'store_id'], as_index=False).agg(**meas)
+    reg = stores[['store_id', 'region']]
+    return cat.merge(reg, on='store_id', how='left'), sto.merge(reg, on='store_id', how='left')
+
+
+def build_rollups(transactions, products, stores, data_dir, incremental=False, fmt=None):
+    """(Re)build both rollups under `data_dir`.
+
+    Incremental runs keep the stored rows before the last rolled-up day and
+    re-aggregate from that day on, so a partially loaded last day is refreshed.
+    They are only correct when transactions are appended: rewritten history
+    (e.g. a regenerated dataset) is not detected, so the default is a full build.
+    """
+    cat_path = storage.table_path(data_dir, 'category_rollup', fmt); sto_path = storage.table_path(data_dir, 'store_rollup', fmt)
+    old_cat = old_sto = None; since = None
+    if incremental and os.path.exists(cat_path) and os.path.exists(sto_path):
+        old_cat = storage.read(cat_path); old_sto = storage.read(sto_path)
+        since = old_cat['date'].max() if len(old_cat) else None
+    tx = storage.read(transactions, columns=['date', 'store_id', 'order_id', 'product_id', 'quantity', 'revenue'], date_from=since)
+    cat, sto = _aggregate(tx, storage.read(products), storage.read(stores))
+    if since is not None:
+        cat = pd.concat([old_cat[old_cat['date'] < since], cat], ignore_index=True)
+        sto = pd.concat([old_sto[old_sto['date'] < since], sto], ignore_index=True)
+    cat = cat.sort_values(['date', 'store_id', 'category'], ignore_index=True); sto = sto.sort_values(['date', 'store_id'], ignore_index=True)
+    storage.write(cat, cat_path); storage.write(sto, sto_path)
+    print(f"Wrote {cat_path} with {len(cat)} rows ({'from ' + str(since.date()) if since is not None else 'full build'})")
+    return cat, sto
+
+
+def query(cat, sto, by=('category',), date_from=None, date_to=None, store_id=None, region=None, category=None):
+    """Slice (filters) and dice (`by` dimensions) the cube; returns one row per group."""
+    by = list(by); unknown = [b for b in by if b not in DIMENSIONS]
+    if unknown: raise ValueError(f"unknown dimension(s) {unknown}; choose from {DIMENSIONS}")
+    df = cat if ('category' in by or category) else sto
+    if date_from: df = df[df['date'] >= pd.to_datetime(date_from)]
+    if date_to: df = df[df['date'] <= pd.to_datetime(date_to)]
+    if store_id is not None: df = df[df['store_id'] == int(store_id)]
+    if region: df = df[df['region'] == region]
+    if category: df = df[df['category'] == category]
+    # group on month-truncated datetimes and format only the grouped rows
+    if 'month' in by: df = df.assign(month=df['date'].to_numpy().astype('datetime64[M]'))
+    if not by: return pd.DataFrame([{m: df[m].sum() for m in MEASURES}])
+    out = df.groupby(by, as_index=False)[MEASURES].sum()
+    if 'month' in by: out['month'] = out['month'].dt.strftime('%Y-%m')
+    return out
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--transactions', default='data/raw/transactions.csv'); ap.add_argument('--products', default='data/raw/products.csv')
+    ap.add_argument('--stores', default='data/raw/stores.csv'); ap.add_argument('--data_dir', default='data/raw')
+    ap.add_argument('--incremental', action='store_true', help='refresh from the last rolled-up day instead of rebuilding (append-only transactions)')
+    a = ap.parse_args(); build_rollups(a.transactions, a.products, a.stores, a.data_dir, incremental=a.incremental)
@@ -1,60 +1,85 @@
 #!/usr/bin/env python3
-import argparse, random, numpy as np, pandas as pd
-from datetime import datetime, timedelta
+import argparse, os, sys, numpy as np, pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
 from PIL import Image, ImageDraw, ImageFont
 CATEGORIES=['Grocery','Home','Electronics','Beauty','Apparel','Outdoor','Toys']
+TX_COLUMNS=['order_id','date','store_id','customer_id','product_id','quantity','unit_price','discount','revenue']
 def _font(sz=28, bold=True):
     try: return ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf' if bold else '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', sz)
     except: return ImageFont.load_default()
 def make_img(path, text):
     img=Image.new('RGB',(320,240),(80,120,160)); d=ImageDraw.Draw(img); f=_font()
     w=d.textlength(text,font=f); d.text(((320-w)/2,100),text,font=f,fill=(255,255,255)); img.save(path)
-def simulate(out_dir='data', start_date='2025-01-01', days=120, customers=500, products=120, stores=4):
-    out=Path(out_dir); (out/'images'/'products').mkdir(parents=True, exist_ok=True)
+def _pick_items(rng, k, n_products):
+    # k distinct products per order: draw a row of 6, redraw only rows whose first k slots collide
+    items=rng.integers(0, n_products, size=(len(k), 6)); valid=np.arange(6)<k[:,None]
+    while True:
+        s=np.sort(np.where(valid, items, n_products+np.arange(6)), axis=1); bad=(s[:,1:]==s[:,:-1]).any(axis=1)
+        if not bad.any(): return items, valid
+        items[bad]=rng.integers(0, n_products, size=(int(bad.sum()), 6))
+def _shard(args):
+    """Line items for one contiguous day range; order ids start at `first_order_id` and ascend day-major, store-minor."""
+    shard, seed, path, day_strs, day_promo, store_ids, orders, first_order_id, customers, base_price, promo_product=args
+    rng=np.random.default_rng(seed); n=int(orders.sum())
+    if n==0: storage.backend_for(path).write_shard(pd.DataFrame(columns=TX_COLUMNS), path, shard); return 0
+    o_day=np.repeat(np.repeat(np.arange(len(day_strs)), len(store_ids)), orders.ravel()); o_store=np.repeat(np.tile(store_ids, len(day_strs)), orders.ravel())
+    k=np.clip(rng.poisson(1.2, n)+1, 1, min(6, len(base_price))); items, valid=_pick_items(rng, k, len(base_price))
+    li=np.nonzero(valid)[0]; pidx=items[valid]; m=len(li)
+    qty=np.clip(rng.poisson(1.0, m)+1, 1, 5)
+    disc=np.where(day_promo[o_day[li]] & promo_product[pidx], np.round(rng.uniform(0.10, 0.30, m), 2), 0.0)
+    price=np.round(base_price[pidx]*(1.0-disc), 2)
+    df=pd.DataFrame({'order_id': first_order_id+li, 'date': day_strs[o_day[li]], 'store_id': o_store[li], 'customer_id': rng.integers(1, customers+1, n)[li],
+                     'product_id': pidx+1, 'quantity': qty, 'unit_price': price, 'discount': disc, 'revenue': np.round(price*qty, 2)})
+    storage.backend_for(path).write_shard(df, path, shard); return m
+def simulate(out_dir='data', start_date='2025-01-01', days=120, customers=500, products=120, stores=4, fmt='csv', seed=None, workers=None, images=True, shard_days=31):
+    """Vectorized generator: per day/store Poisson-style draws, array-indexed prices, sharded by day range.
+
+    Shards are fixed by `shard_days` and seeded from `seed`, so output does not depend on `workers`;
+    each shard streams its line items straight to disk.
+    """
+    out=Path(out_dir); (out/'raw').mkdir(parents=True, exist_ok=True); save=lambda df, table: storage.write(df, storage.table_path(out/'raw', table, fmt))
+    n_shards=(days+shard_days-1)//shard_days; ss=np.random.SeedSequence(seed); rng=np.random.default_rng(ss.spawn(1)[0]); shard_seeds=ss.spawn(n_shards)
+    ex=ProcessPoolExecutor(max_workers=workers)
     # products
-    prows=[]; 
-    for i in range(1, products+1):
-        cat=random.choice(CATEGORIES); name=f"{cat[:3].upper()}-{i:03d}"; price=round(random.uniform(3,200),2)
-        p=out/'images'/'products'/f"{name}.png"; make_img(p, name); prows.append([i,name,cat,price,str(p)])
-    pd.DataFrame(prows, columns=['product_id','name','category','base_price','image_path']).to_csv(out/'raw'/'products.csv', index=False)
+    pid=np.arange(1, products+1); cat=np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), products)]; base_price=np.round(rng.uniform(3, 200, products), 2)
+    names=[f"{c[:3].upper()}-{i:03d}" for c, i in zip(cat, pid)]; paths=[str(out/'images'/'products'/f"{nm}.png") for nm in names]
+    if images: (out/'images'/'products').mkdir(parents=True, exist_ok=True); list(ex.map(make_img, paths, names, chunksize=max(1, products//64)))
+    save(pd.DataFrame({'product_id': pid, 'name': names, 'category': cat, 'base_price': base_price, 'image_path': paths if images else ''}), 'products')
     # stores
     cities=['Springfield','Fairview','Franklin','Greenville','Madison','Georgetown']; regions=['North','South','East','West']
-    srows=[[s, random.choice(cities), random.choice(regions), random.randint(60,180)] for s in range(1, stores+1)]
-    pd.DataFrame(srows, columns=['store_id','city','region','size_index']).to_csv(out/'raw'/'stores.csv', index=False)
+    store_ids=np.arange(1, stores+1); size_index=rng.integers(60, 181, stores)
+    save(pd.DataFrame({'store_id': store_ids, 'city': np.array(cities)[rng.integers(0, len(cities), stores)], 'region': np.array(regions)[rng.integers(0, len(regions), stores)], 'size_index': size_index}), 'stores')
     # customers
-    start=datetime.fromisoformat(start_date); crows=[]
-    for c in range(1, customers+1):
-        signup=(start - timedelta(days=random.randint(0,365))).date().isoformat()
-        crows.append([c, signup, random.choice(CATEGORIES), random.choice(['L','M','H'])])
-    pd.DataFrame(crows, columns=['customer_id','signup_date','pref_category','income_bracket']).to_csv(out/'raw'/'customers.csv', index=False)
-    # visits & transactions
-    dates=[start+timedelta(days=i) for i in range(days)]
-    dfp=pd.read_csv(out/'raw'/'products.csv')
-    promo_products=set(random.sample(list(dfp['product_id']), max(1, products//10)))
-    promo_days=set(random.sample(range(days), max(1, days//6)))
-    vis_rows=[]; tx_rows=[]; order_id=1
-    for di, day in enumerate(dates):
-        wknd=1.25 if day.weekday()>=5 else 1.0; season = 1.0 + (0.15 if day.month in [11,12] else (0.10 if day.month in [6,7] else 0.0))
-        for st in srows:
-            stid=st[0]; base_vis=st[3]
-            visits=int(base_vis * (0.25*season*wknd) * random.uniform(0.8,1.2)); vis_rows.append([day.date().isoformat(), stid, visits])
-            is_promo = di in promo_days; conv = 0.05 + (0.02 if is_promo else 0.0) + random.uniform(-0.003,0.01)
-            orders=max(0, int(visits*conv))
-            for _ in range(orders):
-                cust=random.randint(1, customers); k=max(1,min(6,int(np.random.poisson(1.2)+1))); items=random.sample(list(dfp['product_id']), k)
-                for pid in items:
-                    base=float(dfp.loc[dfp['product_id']==pid,'base_price'].iloc[0])
-                    disc=round(random.uniform(0.10,0.30),2) if (is_promo and pid in promo_products) else 0.0
-                    qty=max(1,min(5,int(np.random.poisson(1)+1)))
-                    price=round(base*(1.0-disc),2); rev=round(price*qty,2)
-                    tx_rows.append([order_id, day.date().isoformat(), stid, cust, int(pid), qty, price, disc, rev])
-                order_id+=1
-    pd.DataFrame(vis_rows, columns=['date','store_id','visits']).to_csv(out/'raw'/'visits.csv', index=False)
-    pd.DataFrame(tx_rows, columns=['order_id','date','store_id','customer_id','product_id','quantity','unit_price','discount','revenue']).to_csv(out/'raw'/'transactions.csv', index=False)
+    start=datetime.fromisoformat(start_date)
+    signup=(np.datetime64(start.date())-rng.integers(0, 366, customers).astype('timedelta64[D]')).astype(str)
+    save(pd.DataFrame({'customer_id': np.arange(1, customers+1), 'signup_date': signup, 'pref_category': np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), customers)],
+                       'income_bracket': np.array(['L','M','H'])[rng.integers(0, 3, customers)]}), 'customers')
+    # visits & orders per (day, store)
+    dates=pd.date_range(start, periods=days, freq='D'); day_strs=dates.strftime('%Y-%m-%d').to_numpy()
+    promo_product=np.zeros(products, bool); promo_product[rng.choice(products, max(1, products//10), replace=False)]=True
+    day_promo=np.zeros(days, bool); day_promo[rng.choice(days, max(1, days//6), replace=False)]=True
+    wknd=np.where(dates.weekday>=5, 1.25, 1.0); season=1.0+np.where(dates.month.isin([11,12]), 0.15, np.where(dates.month.isin([6,7]), 0.10, 0.0))
+    visits=(size_index[None,:]*(0.25*season*wknd)[:,None]*rng.uniform(0.8, 1.2, (days, stores))).astype(int)
+    conv=0.05+np.where(day_promo, 0.02, 0.0)[:,None]+rng.uniform(-0.003, 0.01, (days, stores)); orders=np.maximum(0, (visits*conv).astype(int))
+    save(pd.DataFrame({'date': np.repeat(day_strs, stores), 'store_id': np.tile(store_ids, days), 'visits': visits.ravel()}), 'visits')
+    # transactions, one shard per day range, streamed to disk in shard order
+    tx_path=str(storage.table_path(out/'raw', 'transactions', fmt)); backend=storage.backend_for(tx_path); backend.begin_shards(tx_path)
+    first_ids=1+np.concatenate([[0], np.cumsum([orders[i*shard_days:(i+1)*shard_days].sum() for i in range(n_shards)])])
+    jobs=[(i, shard_seeds[i], tx_path, day_strs[i*shard_days:(i+1)*shard_days], day_promo[i*shard_days:(i+1)*shard_days], store_ids, orders[i*shard_days:(i+1)*shard_days],
+           int(first_ids[i]), customers, base_price, promo_product) for i in range(n_shards)]
+    lines=sum(ex.map(_shard, jobs)); ex.shutdown(); backend.finish_shards(tx_path, TX_COLUMNS)
+    print(f"Wrote {tx_path} with {lines} line items / {int(orders.sum())} orders")
 if __name__=='__main__':
     import argparse; ap=argparse.ArgumentParser()
     ap.add_argument('--out_dir', default='data'); ap.add_argument('--start_date', default='2025-01-01')
     ap.add_argument('--days', type=int, default=120); ap.add_argument('--customers', type=int, default=500)
     ap.add_argument('--products', type=int, default=120); ap.add_argument('--stores', type=int, default=4)
-    a=ap.parse_args(); simulate(a.out_dir, a.start_date, a.days, a.customers, a.products, a.stores)
+    ap.add_argument('--format', choices=['csv','parquet'], default='csv', help='parquet writes data/raw/parquet/<table>/ (needs pyarrow)')
+    ap.add_argument('--seed', type=int, default=None, help='reproducible output (independent of --workers)')
+    ap.add_argument('--workers', type=int, default=None); ap.add_argument('--shard_days', type=int, default=31)
+    ap.add_argument('--no_images', action='store_true', help='skip rendering product images')
+    a=ap.parse_args(); simulate(a.out_dir, a.start_date, a.days, a.customers, a.products, a.stores, a.format, a.seed, a.workers, not a.no_images, a.shard_days)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Storage backends for the data/raw tables: plain CSV or partitioned Parquet.
+
+A table lives either at `<data_dir>/<table>.csv` or as a hive-partitioned
+Parquet dataset at `<data_dir>/parquet/<table>/`. Parquet datasets are split by
+calendar month and store (`month=YYYY-MM/store=N/`), so readers can skip whole
+files for `date_from` / `date_to` / `store_id` filters, push the exact filter
+down to row groups, read only the projected columns and memory-map the files.
+The partition keys are copies; `date` and `store_id` stay in the data columns.
+
+`STORAGE_FORMAT` picks the backend: `auto` (default; Parquet when the dataset
+exists, else CSV), `csv` or `parquet`. Parquet needs `pyarrow`.
+
+    python src/storage.py --data_dir data/raw   # one-shot CSV -> Parquet
+"""
+import argparse, os, shutil, time
+import numpy as np, pandas as pd
+
+TABLES = ['products', 'stores', 'customers', 'visits', 'transactions', 'daily_sales']
+DATE_COLUMNS = {'transactions': ['date'], 'visits': ['date'], 'daily_sales': ['date'], 'customers': ['signup_date'],
+                'category_rollup': ['date'], 'store_rollup': ['date']}
+# partition keys derived at write time: 'month' from date, 'store' from store_id
+PARTITIONS = {'transactions': ['month', 'store'], 'visits': ['month', 'store'], 'daily_sales': ['month'],
+              'category_rollup': ['month'], 'store_rollup': ['month']}
+FORMAT = os.environ.get('STORAGE_FORMAT', 'auto')
+# written last into every Parquet dataset: "<write time ns> <total bytes>"; '_' keeps pyarrow from reading it as data
+MANIFEST = '_MANIFEST'
+
+
+def _table_name(path):
+    return os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise ImportError('Parquet storage needs pyarrow: pip install pyarrow') from e
+
+
+class CsvBackend:
+    def read(self, path, columns=None, date_from=None, date_to=None, store_id=None):
+        need = None if columns is None else list(dict.fromkeys(list(columns) + (['date'] if date_from or date_to else []) + (['store_id'] if store_id is not None else [])))
+        dates = [c for c in DATE_COLUMNS.get(_table_name(path), []) if need is None or c in need]
+        df = pd.read_csv(path, usecols=need, parse_dates=dates)
+        if date_from: df = df[df['date'] >= pd.to_datetime(date_from)]
+        if date_to: df = df[df['date'] <= pd.to_datetime(date_to)]
+        if store_id is not None: df = df[df['store_id'] == int(store_id)]
+        return (df if columns is None else df[list(columns)]).reset_index(drop=True)
+
+    def write(self, df, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True); df.to_csv(path, index=False)
+
+    # sharded writes: headerless part files, concatenated in shard order at the end
+    def begin_shards(self, path):
+        shutil.rmtree(path + '.parts', ignore_errors=True); os.makedirs(path + '.parts')
+
+    def write_shard(self, df, path, shard):
+        df.to_csv(os.path.join(path + '.parts', f'{shard:06d}.csv'), index=False, header=False)
+
+    def finish_shards(self, path, columns):
+        parts = path + '.parts'; tmp = path + '.tmp'
+        with open(tmp, 'w', newline='') as out:
+            out.write(','.join(columns) + '\n')
+            for f in sorted(os.listdir(parts)):
+                with open(os.path.join(parts, f)) as src: shutil.copyfileobj(src, out)
+        os.replace(tmp, path); shutil.rmtree(parts)
+
+
+class ParquetBackend:
+    def read(self, path, columns=None, date_from=None, date_to=None, store_id=None):
+        _require_pyarrow(); import pyarrow.parquet as pq
+        parts = PARTITIONS.get(_table_name(path), []); filters = []
+        if date_from:
+            ts = pd.to_datetime(date_from); filters.append(('date', '>=', ts))
+            if 'month' in parts: filters.append(('month', '>=', ts.strftime('%Y-%m')))
+        if date_to:
+            ts = pd.to_datetime(date_to); filters.append(('date', '<=', ts))
+            if 'month' in parts: filters.append(('month', '<=', ts.strftime('%Y-%m')))
+        if store_id is not None:
+            filters.append(('store_id', '=', int(store_id)))
+            if 'store' in parts: filters.append(('store', '=', int(store_id)))
+        t = pq.read_table(path, columns=list(columns) if columns is not None else None, filters=filters or None, memory_map=True)
+        return t.drop_columns([c for c in parts if c in t.column_names]).to_pandas()
+
+    def write(self, df, path):
+        self.begin_shards(path); self.write_shard(df, path, 0); self.finish_shards(path, list(df.columns))
+
+    def begin_shards(self, path):
+        _require_pyarrow(); shutil.rmtree(os.path.normpath(path) + '.tmp', ignore_errors=True)
+
+    def write_shard(self, df, path, shard):
+        import pyarrow as pa, pyarrow.parquet as pq
+        table = _table_name(path); parts = PARTITIONS.get(table, []); tmp = os.path.normpath(path) + '.tmp'
+        df = df.assign(**{c: pd.to_datetime(df[c]) for c in DATE_COLUMNS.get(table, []) if c in df})
+        if 'month' in parts: df = df.assign(month=df['date'].dt.strftime('%Y-%m'))
+        if 'store' in parts: df = df.assign(store=df['store_id'])
+        at = pa.Table.from_pandas(df, preserve_index=False)
+        if parts: pq.write_to_dataset(at, tmp, partition_cols=parts, basename_template=f'shard{shard:06d}-{{i}}.parquet')
+        else: os.makedirs(tmp, exist_ok=True); pq.write_table(at, os.path.join(tmp, f'shard{shard:06d}.parquet'))
+
+    def finish_shards(self, path, columns):
+        tmp = os.path.normpath(path) + '.tmp'; os.makedirs(tmp, exist_ok=True)
+        # one small file stands for the whole dataset, so `signature` never walks the partitions
+        size = sum(os.path.getsize(f) for f in parquet_files(tmp))
+        with open(os.path.join(tmp, MANIFEST), 'w') as f: f.write(f'{time.time_ns()} {size}\n')
+        shutil.rmtree(path, ignore_errors=True); os.replace(tmp, path)
+
+
+def backend_for(path):
+    # `*.csv` is a CSV file; anything else is a Parquet dataset directory
+    return CsvBackend() if str(path).endswith('.csv') else ParquetBackend()
+
+
+def table_path(data_dir, table, fmt=None):
+    """Where `table` lives under `data_dir` for the configured format."""
+    fmt = fmt or FORMAT; pq_path = os.path.join(data_dir, 'parquet', table); csv_path = os.path.join(data_dir, f'{table}.csv')
+    if fmt == 'parquet' or (fmt == 'auto' and os.path.isdir(pq_path)): return pq_path
+    return csv_path
+
+
+def read(path, columns=None, date_from=None, date_to=None, store_id=None):
+    """Read a CSV file or Parquet dataset with optional projection and filters."""
+    return backend_for(path).read(str(path), columns, date_from, date_to, store_id)
+
+
+def write(df, path):
+    backend_for(path).write(df, str(path))
+
+
+def iter_chunks(path, columns=None, chunksize=1_000_000, date_from=None):
+    """Yield the table in frames of about `chunksize` rows, in file order."""
+    path = str(path); table = _table_name(path)
+    if isinstance(backend_for(path), CsvBackend):
+        dates = [c for c in DATE_COLUMNS.get(table, []) if columns is None or c in columns]
+        for df in pd.read_csv(path, usecols=columns, parse_dates=dates, chunksize=chunksize):
+            yield df[df['date'] >= pd.to_datetime(date_from)] if date_from else df
+        return
+    _require_pyarrow(); import pyarrow.dataset as pads
+    ds = pads.dataset(path, format='parquet', partitioning='hive')
+    flt = (pads.field('date') >= pd.to_datetime(date_from)) if date_from else None
+    for batch in ds.to_batches(columns=list(columns) if columns is not None else None, filter=flt, batch_size=chunksize):
+        yield batch.to_pandas()
+
+
+def parquet_files(path):
+    """Data files of a Parquet dataset in partition order (each holds one month/store at most)."""
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files if f.endswith('.parquet'))
+
+
+def csv_byte_ranges(path, n):
+    """Split a CSV body into `n` newline-aligned (start, end) byte ranges, skipping the header."""
+    size = os.path.getsize(path); bounds = []
+    with open(path, 'rb') as f:
+        f.readline(); body = f.tell()
+        for i in range(n):
+            pos = body + (size - body) * i // n
+            if pos > body: f.seek(pos - 1); f.readline(); pos = f.tell()
+            bounds.append(pos)
+    bounds.append(size); bounds = sorted(set(bounds))
+    return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+def iter_csv_range(path, start, end, columns=None, block_bytes=64 << 20):
+    """Yield frames parsed from bytes [start, end) of a CSV, `block_bytes` at a time, cut at newlines."""
+    import io
+    with open(path, 'rb') as f: names = f.readline().decode().strip().split(',')
+    dates = [c for c in DATE_COLUMNS.get(_table_name(path), []) if columns is None or c in columns]
+    with open(path, 'rb') as f:
+        f.seek(start); carry = b''; pos = start
+        while pos < end:
+            buf = carry + f.read(min(block_bytes, end - pos)); pos = f.tell()
+            cut = len(buf) if pos >= end else buf.rfind(b'\n') + 1
+            if cut <= 0: carry = buf; continue
+            block, carry = buf[:cut], buf[cut:]
+            if block.strip(): yield pd.read_csv(io.BytesIO(block), header=None, names=names, usecols=columns, parse_dates=dates)
+
+
+def order_partial(df, key, **aggs):
+    """Named aggregations `aggs` of one block of transactions by `key`, plus what `fold_partials` needs to merge blocks.
+
+    Records the first / last order id (with its key), the id range, and whether each order's rows are contiguous ('ok').
+    """
+    if df.empty: return None
+    oid = df['order_id'].to_numpy(); runs = 1 + int((oid[1:] != oid[:-1]).sum())
+    return {'agg': df.groupby(key).agg(**aggs), 'first': (oid[0], df[key].iat[0]), 'last': (oid[-1], df[key].iat[-1]),
+            'min': oid.min(), 'max': oid.max(), 'ok': runs == len(np.unique(oid))}
+
+
+def fold_partials(a, b, how, count):
+    """Combine two `order_partial`s, `a` preceding `b` in file order; `how` is the reduction combining each column.
+
+    An order split across the boundary is counted in both blocks, so one is dropped from its key's `count` (distinct
+    orders). That is only exact when order ids are contiguous and ascending through the file; otherwise 'ok' is False
+    and the caller has to recount distinct orders.
+    """
+    if a is None or b is None: return a or b
+    agg = pd.concat([a['agg'], b['agg']]).groupby(level=0).agg(how)
+    if a['last'][0] == b['first'][0]: agg.loc[b['first'][1], count] -= 1
+    ordered = a['max'] < b['min'] or (a['max'] == b['min'] == a['last'][0] == b['first'][0])
+    return {'agg': agg, 'first': a['first'], 'last': b['last'], 'min': min(a['min'], b['min']), 'max': max(a['max'], b['max']),
+            'ok': a['ok'] and b['ok'] and ordered}
+
+def signature(path):
+    """(mtime_ns, size) of a file; for a dataset directory, the write time and total size from its manifest.
+
+    Every dataset is swapped in whole by `finish_shards`, so the manifest changes whenever any file does.
+    Directories written without one (older writers) fall back to statting every file.
+    """
+    if not os.path.isdir(path):
+        st = os.stat(path); return (st.st_mtime_ns, st.st_size)
+    try:
+        with open(os.path.join(path, MANIFEST)) as f: mtime, size = map(int, f.read().split())
+        return (mtime, size)
+    except (OSError, ValueError): pass
+    mtime = os.stat(path).st_mtime_ns; size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            st = os.stat(os.path.join(root, f)); mtime = max(mtime, st.st_mtime_ns); size += st.st_size
+    return (mtime, size)
+
+
+def fingerprint(df):
+    """Order-independent content hash of a frame's rows; CSV and Parquet reads return rows in different orders.
+
+    Datetime columns are hashed at day precision, so the resolution a backend reads them back in does not matter.
+    """
+    df = df.assign(**{c: df[c].to_numpy().astype('datetime64[D]').astype(np.int64) for c in df if pd.api.types.is_datetime64_any_dtype(df[c])})
+    return int(pd.util.hash_pandas_object(df, index=False).to_numpy().sum(dtype=np.uint64))
+
+
+def convert(data_dir, tables=TABLES):
+    """Write every existing `<table>.csv` under `data_dir` as a Parquet dataset."""
+    _require_pyarrow(); done = []
+    for t in tables:
+        src = os.path.join(data_dir, f'{t}.csv')
+        if not os.path.exists(src): continue
+        write(read(src), os.path.join(data_dir, 'parquet', t)); done.append(t)
+    return done
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(); ap.add_argument('--data_dir', default='data/raw'); ap.add_argument('--tables', nargs='*', default=TABLES)
+    a = ap.parse_args(); print('Converted to Parquet:', ', '.join(convert(a.data_dir, a.tables)) or 'nothing')
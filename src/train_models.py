@@ -1,17 +1,104 @@
 #!/usr/bin/env python3
-import argparse, os, pandas as pd, numpy as np, joblib
-from sklearn.cluster import KMeans
+import argparse, json, os, sys, time, pandas as pd, numpy as np, joblib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import forecasting, storage
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.linear_model import LinearRegression
-def build_rfm(tx_csv, out_csv, n_segments=4, random_state=42):
-    tx=pd.read_csv(tx_csv, parse_dates=['date']); now=tx['date'].max() + pd.Timedelta(days=1)
-    agg=tx.groupby('customer_id').agg(recency=('date', lambda s: (now - s.max()).days), frequency=('order_id','nunique'), monetary=('revenue','sum')).reset_index()
-    feats=agg[['recency','frequency','monetary']].values.astype(float); km=KMeans(n_clusters=n_segments, n_init=10, random_state=random_state).fit(feats)
-    agg['segment']=km.labels_; agg.to_csv(out_csv, index=False); return km
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+STAGES=[]
+def _peak_rss_mb():
+    try: import resource
+    except ImportError: return None  # Windows
+    kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb/1024/(1024 if sys.platform=='darwin' else 1)
+@contextmanager
+def stage(name):
+    """Record wall-clock seconds and the process peak RSS (high-water mark, so growth pinpoints the stage) for one stage."""
+    before=_peak_rss_mb(); t0=time.perf_counter()
+    try: yield
+    finally:
+        dt=time.perf_counter()-t0; peak=_peak_rss_mb()
+        STAGES.append({'stage': name, 'seconds': round(dt, 3), 'peak_rss_mb': peak and round(peak, 1), 'rss_growth_mb': peak and round(peak-before, 1)})
+        print(f"[{name}] {dt:.2f}s" + (f", peak RSS {peak:.0f} MB (+{peak-before:.0f})" if peak else ''))
+def _rfm_partial(tx):
+    return storage.order_partial(tx.assign(date=pd.to_datetime(tx['date'])), 'customer_id', last=('date','max'), frequency=('order_id','nunique'), monetary=('revenue','sum'))
+def _rfm_fold(a, b):
+    # same straddling-order rule as the daily rollup in preprocess_sales; not 'ok' means frequency must be recounted
+    return storage.fold_partials(a, b, {'last': 'max', 'frequency': 'sum', 'monetary': 'sum'}, 'frequency')
+def rfm_features(tx_csv, chunksize=None):
+    """Per-customer recency / frequency / monetary with vectorized groupby reductions, optionally from chunked input."""
+    cols=['customer_id','date','order_id','revenue']
+    if not chunksize: part={**_rfm_partial(storage.read(tx_csv, columns=cols)), 'ok': True}
+    else:
+        part=None
+        for chunk in storage.iter_chunks(tx_csv, cols, chunksize): part=_rfm_fold(part, _rfm_partial(chunk))
+        if not part['ok']:
+            pairs=pd.concat([c.drop_duplicates() for c in storage.iter_chunks(tx_csv, ['customer_id','order_id'], chunksize)]).drop_duplicates()
+            part['agg']['frequency']=pairs.groupby('customer_id')['order_id'].nunique()
+    agg=part['agg']; now=agg['last'].max()+pd.Timedelta(days=1)
+    return pd.DataFrame({'customer_id': agg.index, 'recency': (now-agg['last']).dt.days.to_numpy(), 'frequency': agg['frequency'].astype('int64').to_numpy(), 'monetary': agg['monetary'].to_numpy()})
+def fit_segments(feats, n_segments=4, algo='minibatch', random_state=42, batch_size=4096, model=None):
+    """Scaled K-Means on RFM features. With `model` (a previous minibatch pipeline) the centers are updated via partial_fit instead of refitting."""
+    if model is not None and isinstance(model, Pipeline) and hasattr(model.named_steps['km'], 'partial_fit'):
+        scale, km=model.named_steps['scale'], model.named_steps['km']; X=scale.transform(feats)
+        for i in range(0, len(X), batch_size): km.partial_fit(X[i:i+batch_size])
+        return model
+    km=KMeans(n_clusters=n_segments, n_init=10, random_state=random_state) if algo=='kmeans' else MiniBatchKMeans(n_clusters=n_segments, batch_size=batch_size, n_init=3, random_state=random_state)
+    return Pipeline([('scale', StandardScaler()), ('km', km)]).fit(feats)
+def build_rfm(tx_csv, out_csv, n_segments=4, random_state=42, algo='minibatch', chunksize=None, batch_size=4096, model=None):
+    with stage('rfm.features'): agg=rfm_features(tx_csv, chunksize)
+    with stage('rfm.cluster'):
+        feats=agg[['recency','frequency','monetary']].to_numpy(float); km=fit_segments(feats, n_segments, algo, random_state, batch_size, model)
+        agg['segment']=np.concatenate([km.predict(feats[i:i+batch_size*16]) for i in range(0, len(feats), batch_size*16)]) if len(feats) else []
+    with stage('rfm.write'): agg.to_csv(out_csv, index=False)
+    return km
 def build_forecast(daily_csv, model_out):
-    df=pd.read_csv(daily_csv, parse_dates=['date']).sort_values('date'); df['t']=range(len(df))
+    df=storage.read(daily_csv, columns=['date','revenue']).sort_values('date'); df['t']=range(len(df))
     for lag in [1,7]: df[f'rev_lag{lag}']=df['revenue'].shift(lag); df=df.dropna()
     X=df[['t','rev_lag1','rev_lag7']].values; y=df['revenue'].values; lr=LinearRegression().fit(X,y)
     os.makedirs(model_out, exist_ok=True); joblib.dump(lr, os.path.join(model_out,'daily_revenue_lr.joblib')); print('Saved forecast model')
+SERIES_ARTIFACT='series_forecasts.joblib'; SERIES_POOL_MIN=5000
+def series_panel(rollup_path):
+    """Dense (store x category) x day revenue matrix from the category rollup; days without sales are 0."""
+    cat=storage.read(rollup_path, columns=['date','store_id','region','category','revenue'])
+    days=pd.date_range(cat['date'].min(), cat['date'].max(), freq='D')
+    Y=cat.pivot_table(index=['store_id','category'], columns='date', values='revenue', aggfunc='sum', fill_value=0.0).reindex(columns=days, fill_value=0.0)
+    keys=Y.index.to_frame(index=False).merge(cat[['store_id','region']].drop_duplicates('store_id'), on='store_id', how='left')
+    return keys[['store_id','region','category']], days, Y.to_numpy(float)
+def _fit_series(args):
+    # one chunk of series: batched least squares, then the recursive path for all of them at once
+    Y, horizon=args; coef, icpt=forecasting.fit_panel(Y); T=Y.shape[1]
+    pred=forecasting.recursive_forecast(forecasting.panel_predict(coef, icpt), np.full(len(Y), T-1), Y[:,-1], Y[:,-7], horizon)
+    return coef, icpt, pred
+def build_series_forecasts(rollup_path, model_out, horizon=56, workers=None):
+    """Per store x category lag models fitted in a process pool; saves coefficients and precomputed forecasts in one artifact."""
+    with stage('series.features'): keys, days, Y=series_panel(rollup_path)
+    if Y.shape[1]<14: print('Not enough history for series forecasts; skipped'); return None
+    with stage('series.fit'):
+        chunks=np.array_split(Y, max(1, min(len(Y), 4*(workers or os.cpu_count() or 1))))
+        if workers==1 or len(Y)<SERIES_POOL_MIN: parts=[_fit_series((c, horizon)) for c in chunks]  # pool start-up outweighs small panels
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as ex: parts=list(ex.map(_fit_series, [(c, horizon) for c in chunks]))
+        coef, icpt, pred=(np.concatenate(x) for x in zip(*parts))
+    art={'keys': keys, 'last_date': days[-1], 'dates': [str(d.date()) for d in pd.date_range(days[-1]+pd.Timedelta(days=1), periods=horizon)],
+         'coef': coef.astype(np.float32), 'intercept': icpt.astype(np.float32), 'pred': pred.astype(np.float32)}
+    joblib.dump(art, os.path.join(model_out, SERIES_ARTIFACT)); print(f'Saved {len(keys)} series forecasts ({horizon} days)')
+    return art
 if __name__=='__main__':
     ap=argparse.ArgumentParser(); ap.add_argument('--transactions', default='data/raw/transactions.csv'); ap.add_argument('--daily', default='data/raw/daily_sales.csv'); ap.add_argument('--model_out', default='models')
-    a=ap.parse_args(); os.makedirs(a.model_out, exist_ok=True); import joblib; km=build_rfm(a.transactions, os.path.join(a.model_out,'rfm_segments.csv')); joblib.dump(km, os.path.join(a.model_out,'rfm_kmeans.joblib')); build_forecast(a.daily, a.model_out)
+    ap.add_argument('--rfm_algo', choices=['minibatch','kmeans'], default='minibatch'); ap.add_argument('--n_segments', type=int, default=4)
+    ap.add_argument('--rfm_update', action='store_true', help='update the saved minibatch centers with partial_fit instead of refitting')
+    ap.add_argument('--chunksize', type=int, default=None, help='read transactions for RFM in chunks of this many rows')
+    ap.add_argument('--rollup', default='data/raw/category_rollup.csv', help='category rollup for the per store x category forecasts (skipped if missing)')
+    ap.add_argument('--series_horizon', type=int, default=56); ap.add_argument('--workers', type=int, default=None)
+    a=ap.parse_args(); os.makedirs(a.model_out, exist_ok=True); km_path=os.path.join(a.model_out,'rfm_kmeans.joblib')
+    prev=joblib.load(km_path) if a.rfm_update and os.path.exists(km_path) else None
+    km=build_rfm(a.transactions, os.path.join(a.model_out,'rfm_segments.csv'), a.n_segments, algo=a.rfm_algo, chunksize=a.chunksize, model=prev); joblib.dump(km, km_path)
+    with stage('forecast'): build_forecast(a.daily, a.model_out)
+    if os.path.exists(a.rollup): build_series_forecasts(a.rollup, a.model_out, a.series_horizon, a.workers)
+    from basket import build_basket
+    with stage('basket'): build_basket(a.transactions, a.model_out)
+    with open(os.path.join(a.model_out, 'train_report.json'), 'w') as f: json.dump(STAGES, f, indent=1)
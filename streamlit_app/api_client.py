@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Data access for the dashboard: a pooled HTTP session, concurrent fetches and a version-aware response cache.
+
+- Every request goes through one `requests.Session`, so connections to the
+  API are kept alive and reused across reruns.
+- `ApiClient.submit({name: (path, params[, table])})` starts all of a page's
+  requests at once on a small thread pool and returns futures.
+- Responses are cached per (path, params) for `ttl` seconds. Each entry is
+  stamped with the endpoint's token from the API's `/version`, and an entry
+  whose token has changed is fetched again. Endpoints whose data did not
+  change keep their entries. `/version` is polled at most every
+  `version_ttl` seconds, which bounds how stale a page can be.
+- Table endpoints are fetched as Arrow when pyarrow is installed (columnar
+  JSON otherwise). A stale table is revalidated with its ETag, so unchanged
+  rows cost a 304 rather than a download.
+"""
+import threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd, requests
+from requests.adapters import HTTPAdapter
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+def _pyarrow():
+    try: import pyarrow
+    except ImportError: return None
+    return pyarrow
+
+
+def _decode(r, table):
+    if not table: return r.json()
+    pa = _pyarrow()
+    if pa and r.headers.get('content-type', '').startswith(ARROW_MEDIA_TYPE): return pa.ipc.open_stream(r.content).read_pandas()
+    return pd.DataFrame(r.json())
+
+
+class ApiClient:
+    """Cached, pooled client for the analytics API; one instance can be shared by every session."""
+
+    def __init__(self, base_url, ttl=300.0, version_ttl=5.0, workers=8, max_entries=256, timeout=30):
+        self.base_url = base_url.rstrip('/'); self.ttl = ttl; self.version_ttl = version_ttl
+        self.timeout = timeout; self.max_entries = max_entries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter); self.session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api-fetch')
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (path, params) -> (version, fetched_at, etag, value)
+        self._versions, self._versions_at = {}, None
+        self.counters = {'hits': 0, 'misses': 0, 'revalidated': 0}
+
+    def versions(self, refresh=False):
+        """{endpoint path: version token} from `/version`, re-polled after `version_ttl` seconds or when `refresh`."""
+        with self._lock:
+            if not refresh and self._versions_at is not None and time.monotonic() - self._versions_at < self.version_ttl:
+                return self._versions
+        try:
+            r = self.session.get(f'{self.base_url}/version', timeout=self.timeout); r.raise_for_status()
+            v = r.json().get('endpoints', {})
+        except (requests.RequestException, ValueError):
+            v = {}  # an API without /version: entries then expire by TTL alone
+        with self._lock: self._versions, self._versions_at = v, time.monotonic()
+        return v
+
+    def get(self, path, params=None, table=False, version=None):
+        """Body of GET `path` (a DataFrame when `table`), from the cache while its version and TTL hold."""
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        if table: params['format'] = 'arrow' if _pyarrow() else 'columns'
+        key = (path, tuple(sorted(params.items())))
+        if version is None: version = self.versions().get(path)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                if hit[0] == version and time.monotonic() - hit[1] < self.ttl:
+                    self.counters['hits'] += 1; return hit[3]
+        hdrs = {'If-None-Match': hit[2]} if hit is not None and hit[2] else {}
+        r = self.session.get(f'{self.base_url}{path}', params=params, headers=hdrs, timeout=self.timeout)
+        if r.status_code == 304: value = hit[3]; counter = 'revalidated'
+        else: r.raise_for_status(); value = _decode(r, table); counter = 'misses'
+        with self._lock:
+            self.counters[counter] += 1
+            self._cache[key] = (version, time.monotonic(), r.headers.get('ETag'), value); self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries: self._cache.popitem(last=False)
+        return value
+
+    def submit(self, calls):
+        """Start `calls` ({name: (path, params[, table])}) concurrently; returns {name: Future}."""
+        versions = self.versions()
+        return {name: self._pool.submit(self.get, path, *args, version=versions.get(path)) for name, (path, *args) in calls.items()}
+
+    def call(self, method, path, **kwargs):
+        """Uncached request (training, job status); returns the JSON body."""
+        return self.session.request(method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs).json()
+
+    def stats(self):
+        with self._lock: return {**self.counters, 'entries': len(self._cache)}
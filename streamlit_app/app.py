@@ -1,50 +1,122 @@
-import os, requests, pandas as pd, numpy as np, streamlit as st
+import os, sys, pandas as pd, numpy as np, streamlit as st
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from api_client import ApiClient
+DAILY_CSV = 'data/raw/daily_sales.csv'
+# slider maxima / minimum: fetched once, then sliced locally so moving a slider sends no request
+MAX_PAIRS, MAX_HORIZON, MIN_Z = 30, 42, 1.5
 st.set_page_config(page_title='Retail Analytics Dashboard', layout='wide')
 st.title('🛒 AI-Driven Retail Analytics Dashboard')
 with st.sidebar:
     st.header('Data Source')
     mode = st.radio('Mode', ['CSV Mode (local files)', 'API Mode (http://localhost:8000)'])
     api_url = st.text_input('API base URL', 'http://localhost:8000')
-def load_daily_csv(path='data/raw/daily_sales.csv'):
-    try: return pd.read_csv(path, parse_dates=['date']).sort_values('date')
+api = mode.startswith('API')
+@st.cache_resource
+def get_client(api_url):
+    # one connection pool + response cache per API URL, shared by every session and rerun
+    return ApiClient(api_url)
+@st.cache_data(max_entries=4)
+def _read_daily(path, mtime):
+    # keyed on the file's mtime, so reruns reuse the parsed table until the CSV is rewritten
+    return pd.read_csv(path, parse_dates=['date']).sort_values('date')
+def load_daily_csv(path=DAILY_CSV):
+    try: return _read_daily(path, os.path.getmtime(path))
     except Exception as e: st.error(f'Could not read {path}: {e}'); return pd.DataFrame()
+@st.cache_data(max_entries=4)
+def daily_zscores(path, mtime):
+    """14-day rolling revenue z-scores, computed once per version of the CSV; the slider only filters them."""
+    d = _read_daily(path, mtime); x = d['revenue']; r = x.rolling(14, min_periods=7)
+    return d[['date','revenue']].assign(z=(x-r.mean())/r.std().replace(0, np.nan)).dropna(subset=['z'])
 
+# widgets and placeholders first, so every request of this rerun is known up front and sent together
 tab1, tab2, tab3, tab4 = st.tabs(['Overview','Segments','Basket','Forecast'])
 with tab1:
-    st.subheader('Overview KPIs')
-    if mode.startswith('API'):
-        ov = requests.get(f'{api_url}/metrics/overview', timeout=30).json()
-        daily = pd.DataFrame(requests.get(f'{api_url}/metrics/daily', timeout=30).json())
-    else:
-        daily = load_daily_csv()
-        ov = {'revenue': float(daily['revenue'].sum()), 'orders': int(daily['orders'].sum()), 'units': int(daily['units'].sum()), 'aov': float(daily['revenue'].sum()/max(1,daily['orders'].sum())), 'conversion': float(daily['orders'].sum()/max(1,daily['visits'].sum()))}
-    c1,c2,c3,c4 = st.columns(4)
-    c1.metric('Revenue', f"${ov['revenue']:.0f}"); c2.metric('Orders', f"{ov['orders']}"); c3.metric('AOV', f"${ov['aov']:.2f}"); c4.metric('Conversion', f"{ov['conversion']*100:.2f}%")
-    st.markdown('#### Revenue over time'); st.line_chart(daily.set_index('date')['revenue'])
-    st.markdown('#### Anomalies (z-score)'); z = st.slider('Z threshold', 1.5, 5.0, 3.0, 0.1)
-    if mode.startswith('API'):
-        arr = requests.get(f'{api_url}/alerts/anomalies', params={'z': z}, timeout=30).json(); st.dataframe(pd.DataFrame(arr))
-    else:
-        x=daily['revenue']; mu=x.rolling(14, min_periods=7).mean(); sd=x.rolling(14, min_periods=7).std().replace(0, np.nan); zscore=(x-mu)/sd
-        st.dataframe(daily.assign(z=zscore).loc[abs(zscore)>=z, ['date','revenue','z']])
+    st.subheader('Overview KPIs'); kpi_box = st.container()
+    st.markdown('#### Revenue over time'); revenue_box = st.container()
+    st.markdown('#### Anomalies (z-score)'); z = st.slider('Z threshold', MIN_Z, 5.0, 3.0, 0.1); anomaly_box = st.container()
 with tab2:
     st.subheader("RFM Segments")
-
-    if mode.startswith("API"):
-        # --- Train button ---
+    if api:
+        client = get_client(api_url)
+        # --- Train button (runs as a background job on the API) ---
         if st.button("🔁 Train models now"):
             try:
-                r = requests.post(f"{api_url}/admin/train", timeout=300).json()
+                r = client.call("POST", "/admin/train")
                 if r.get("ok"):
-                    st.success("Models trained. Refresh tabs to see updates.")
+                    st.session_state["train_job"] = r["job_id"]
                 else:
                     st.error(r)
             except Exception as e:
                 st.error(f"Training failed: {e}")
+        if st.session_state.get("train_job"):
+            jid = st.session_state["train_job"]
+            try:
+                job = client.call("GET", f"/admin/jobs/{jid}")
+                status = job.get("status", "unknown")
+                if status in ("queued", "running"):
+                    st.info(f"Training job {jid} is {status}…")
+                    st.button("Check training status")
+                elif status == "succeeded":
+                    st.success("Models trained and loaded by the API.")
+                    st.session_state.pop("train_job")
+                    client.versions(refresh=True)  # new models: drop cached segments / forecasts now
+                else:
+                    st.error(f"Training job {jid} {status}")
+                    with st.expander("Job log"):
+                        st.code(client.call("GET", f"/admin/jobs/{jid}/log").get("log", ""))
+                    st.session_state.pop("train_job")
+            except Exception as e:
+                st.error(f"Could not fetch training status: {e}")
+    seg_box = st.container()
+with tab3:
+    st.subheader('Top Co-occurring Product Pairs'); n = st.slider('How many pairs?', 5, MAX_PAIRS, 10); pairs_box = st.container()
+with tab4:
+    st.subheader('Forecast daily revenue'); h = st.slider('Horizon (days)', 7, MAX_HORIZON, 14); forecast_box = st.container()
+
+if api:
+    got = client.submit({
+        'overview': ('/metrics/overview', None), 'daily': ('/metrics/daily', None, True),
+        'anomalies': ('/alerts/anomalies', {'z': MIN_Z}), 'segments': ('/rfm/segments', None), 'summary': ('/rfm/summary', None),
+        'pairs': ('/basket/top_pairs', {'n': MAX_PAIRS}), 'forecast': ('/forecast/daily', {'h': MAX_HORIZON}),
+    })
+    daily = got['daily'].result()
+else:
+    daily = load_daily_csv()
+
+# ---- Drill-downs ----
+st.markdown("#### Revenue by category")
+if api:
+    # date range selector based on available daily data
+    dmin = pd.to_datetime(daily["date"].min()).date()
+    dmax = pd.to_datetime(daily["date"].max()).date()
+    dfrom, dto = st.date_input("Date range", value=(dmin, dmax))
+    store_id = st.text_input("Store ID (optional)", value="")
+    region = st.text_input("Region (optional)", value="")
+    params = {"date_from": str(dfrom), "date_to": str(dto)}
+    if store_id.strip(): params["store_id"] = store_id.strip()
+    if region.strip(): params["region"] = region.strip()
+    got.update(client.submit({"by_category": ("/metrics/by_category", params)}))
+    category_box = st.container()
+else:
+    st.info("Switch to API Mode to use drill-downs.")
 
+with kpi_box:
+    if api: ov = got['overview'].result()
+    else: ov = {'revenue': float(daily['revenue'].sum()), 'orders': int(daily['orders'].sum()), 'units': int(daily['units'].sum()), 'aov': float(daily['revenue'].sum()/max(1,daily['orders'].sum())), 'conversion': float(daily['orders'].sum()/max(1,daily['visits'].sum()))}
+    c1,c2,c3,c4 = st.columns(4)
+    c1.metric('Revenue', f"${ov['revenue']:.0f}"); c2.metric('Orders', f"{ov['orders']}"); c3.metric('AOV', f"${ov['aov']:.2f}"); c4.metric('Conversion', f"{ov['conversion']*100:.2f}%")
+with revenue_box: st.line_chart(daily.set_index('date')['revenue'])
+with anomaly_box:
+    if api:
+        arr = pd.DataFrame(got['anomalies'].result()); st.dataframe(arr[arr['z'].abs()>=z] if 'z' in arr else arr)
+    else:
+        try: zs = daily_zscores(DAILY_CSV, os.path.getmtime(DAILY_CSV)); st.dataframe(zs[zs['z'].abs()>=z])
+        except Exception as e: st.error(f'Could not compute anomalies: {e}')
+with seg_box:
+    if api:
         # --- Segment counts + sample table ---
         try:
-            seg = requests.get(f"{api_url}/rfm/segments", timeout=30).json()
+            seg = got["segments"].result()
             if "error" in seg:
                 st.warning(seg["error"])
             else:
@@ -58,7 +130,7 @@ with tab2:
         # --- NEW: medians & auto labels table ---
         st.markdown("#### Segment medians & labels")
         try:
-            summ = requests.get(f"{api_url}/rfm/summary", timeout=30).json()
+            summ = got["summary"].result()
             if "summary" in summ:
                 df_sum = (pd.DataFrame(summ["summary"])
                           .rename(columns={
@@ -81,37 +153,20 @@ with tab2:
 
     else:
         st.info("Switch to API Mode to view RFM segments.")
-
-with tab3:
-    st.subheader('Top Co-occurring Product Pairs'); n = st.slider('How many pairs?', 5, 30, 10)
-    if mode.startswith('API'):
-        js = requests.get(f'{api_url}/basket/top_pairs', params={'n': n}, timeout=30).json(); st.dataframe(pd.DataFrame(js.get('pairs', [])))
+with pairs_box:
+    if api: js = got['pairs'].result(); st.dataframe(pd.DataFrame(js.get('pairs', [])[:n]))
     else: st.info('Use API Mode to compute across orders.')
-with tab4:
-    st.subheader('Forecast daily revenue'); h = st.slider('Horizon (days)', 7, 42, 14)
-    if mode.startswith('API'):
-        js = requests.get(f'{api_url}/forecast/daily', params={'h': h}, timeout=30).json(); pred = pd.DataFrame(js['pred']); st.line_chart(pred.set_index('date')['pred']); st.caption(f"Model: {js['model']}")
-    else:
-        daily = load_daily_csv(); mean = daily.tail(7)['revenue'].mean(); future = pd.DataFrame({'date': pd.date_range(daily['date'].max()+pd.Timedelta(days=1), periods=h).date, 'pred': mean}); st.line_chart(future.set_index('date')['pred']); st.caption('Model: naive-mean7')
-
-# ---- Drill-downs ----
-st.markdown("#### Revenue by category")
-if mode.startswith("API"):
-    # date range selector based on available daily data
-    dmin = pd.to_datetime(daily["date"].min()).date()
-    dmax = pd.to_datetime(daily["date"].max()).date()
-    dfrom, dto = st.date_input("Date range", value=(dmin, dmax))
-    store_id = st.text_input("Store ID (optional)", value="")
-    region = st.text_input("Region (optional)", value="")
-    params = {"date_from": str(dfrom), "date_to": str(dto)}
-    if store_id.strip(): params["store_id"] = store_id.strip()
-    if region.strip(): params["region"] = region.strip()
-    cat = requests.get(f"{api_url}/metrics/by_category", params=params, timeout=30).json()
-    df_cat = pd.DataFrame(cat)
-    if not df_cat.empty:
-        st.bar_chart(df_cat.set_index("category")["revenue"])
+with forecast_box:
+    if api:
+        # shorter horizons are prefixes of the longest path
+        js = got['forecast'].result(); pred = pd.DataFrame(js['pred'][:h]); st.line_chart(pred.set_index('date')['pred']); st.caption(f"Model: {js['model']}")
     else:
-        st.info("No matching data for the selected filters.")
-else:
-    st.info("Switch to API Mode to use drill-downs.")
-
+        mean = daily.tail(7)['revenue'].mean(); future = pd.DataFrame({'date': pd.date_range(daily['date'].max()+pd.Timedelta(days=1), periods=h).date, 'pred': mean}); st.line_chart(future.set_index('date')['pred']); st.caption('Model: naive-mean7')
+if api:
+    with category_box:
+        df_cat = pd.DataFrame(got["by_category"].result())
+        if not df_cat.empty:
+            st.bar_chart(df_cat.set_index("category")["revenue"])
+        else:
+            st.info("No matching data for the selected filters.")
+    st.sidebar.caption("API cache: {hits} hits, {misses} fetched, {revalidated} revalidated, {entries} entries".format(**get_client(api_url).stats()))
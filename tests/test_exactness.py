@@ -0,0 +1,174 @@
+"""Exactness checks for the streaming / incremental paths against their full-batch equivalents.
+
+    python -m pytest -q tests
+"""
+import os, shutil, sys
+import numpy as np, pandas as pd, pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import anomaly, basket, preprocess_sales, rollup, simulate_retail, storage, train_models
+
+
+@pytest.fixture(scope='module')
+def raw(tmp_path_factory):
+    out = tmp_path_factory.mktemp('data')
+    simulate_retail.simulate(str(out), '2025-01-01', days=45, customers=300, products=40, stores=3, seed=7, workers=1, images=False)
+    return str(out / 'raw')
+
+
+@pytest.fixture(scope='module')
+def regenerated(tmp_path_factory):
+    # the same date range from another seed, and more days, so the file is larger than `raw`
+    out = tmp_path_factory.mktemp('regenerated')
+    simulate_retail.simulate(str(out), '2025-01-01', days=60, customers=300, products=40, stores=3, seed=8, workers=1, images=False)
+    return str(out / 'raw')
+
+
+def _batch_daily(raw, tmp):
+    out = os.path.join(tmp, 'batch.csv'); preprocess_sales.preprocess(f'{raw}/transactions.csv', f'{raw}/visits.csv', out)
+    return pd.read_csv(out, parse_dates=['date'])
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7, 50])
+def test_csv_byte_ranges_cover_body_on_line_boundaries(raw, n):
+    path = f'{raw}/transactions.csv'
+    with open(path, 'rb') as f: data = f.read()
+    ranges = storage.csv_byte_ranges(path, n)
+    assert ranges[0][0] == data.index(b'\n') + 1 and ranges[-1][1] == len(data)
+    assert all(e == s for (_, e), (s, _) in zip(ranges[:-1], ranges[1:]))
+    assert all(data[s - 1:s] == b'\n' for s, _ in ranges)
+
+
+def test_folded_blocks_match_batch(raw, tmp_path):
+    # tiny blocks and many ranges, so plenty of orders straddle a boundary
+    path = f'{raw}/transactions.csv'; part = None
+    for s, e in storage.csv_byte_ranges(path, 9):
+        part = preprocess_sales._fold(part, preprocess_sales._range_partial((path, s, e, None, 2048)))
+    assert part['ok']
+    got = part['agg'].sort_index(); ref = _batch_daily(raw, tmp_path).set_index('date')
+    assert (got['orders'].to_numpy() == ref['orders'].to_numpy()).all()
+    assert (got['units'].to_numpy() == ref['units'].to_numpy()).all()
+    np.testing.assert_allclose(got['revenue'].to_numpy(), ref['revenue'].to_numpy(), rtol=1e-12)
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_streaming_daily_matches_batch(raw, tmp_path, shuffle):
+    tx = f'{raw}/transactions.csv'
+    if shuffle:  # orders no longer contiguous: the distinct-order recount must kick in
+        tx = str(tmp_path / 'transactions.csv'); pd.read_csv(f'{raw}/transactions.csv').sample(frac=1, random_state=0).to_csv(tx, index=False)
+    out = str(tmp_path / 'daily_sales.csv')
+    preprocess_sales.preprocess_streaming(tx, f'{raw}/visits.csv', out, workers=2)
+    got = pd.read_csv(out, parse_dates=['date']); ref = _batch_daily(raw, tmp_path)
+    assert list(got.columns) == list(ref.columns) and (got['date'] == ref['date']).all()
+    for c in ('orders', 'units', 'visits'): assert (got[c] == ref[c]).all(), c
+    for c in ('revenue', 'aov', 'conversion'): np.testing.assert_allclose(got[c], ref[c], rtol=1e-12)
+
+
+def test_rolling_window_matches_direct_computation():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 50, size=(6, 120)).astype(float) * 1.37
+    x[1, 20:60] = 5.0; x[2] = 0.0; x[3, :30] = 0.0  # constant stretches and an all-zero series
+    win = anomaly.RollingWindow(len(x)); got = np.column_stack([win.push(x[:, t]) for t in range(x.shape[1])])
+    for t in range(x.shape[1]):
+        w = x[:, max(0, t - anomaly.WINDOW + 1):t + 1]
+        if w.shape[1] < anomaly.MIN_PERIODS: assert np.isnan(got[:, t]).all(); continue
+        sd = w.std(axis=1, ddof=1)
+        ref = np.where(sd > 0, (x[:, t] - w.mean(axis=1)) / np.where(sd > 0, sd, 1), np.nan)
+        np.testing.assert_allclose(got[:, t], ref, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_incremental_anomaly_state_matches_full_rebuild(raw, tmp_path):
+    full, inc = tmp_path / 'full', tmp_path / 'inc'
+    for d in (full, inc): os.makedirs(d)
+    for t in ('transactions', 'products', 'stores', 'visits'): shutil.copy(f'{raw}/{t}.csv', full)
+    preprocess_sales.preprocess(f'{full}/transactions.csv', f'{full}/visits.csv', f'{full}/daily_sales.csv')
+    rollup.build_rollups(f'{full}/transactions.csv', f'{full}/products.csv', f'{full}/stores.csv', str(full))
+    tables = {spec['table']: pd.read_csv(f'{full}/{spec["table"]}.csv', parse_dates=['date']) for spec in anomaly.LEVELS.values()}
+    days = sorted(tables['daily_sales']['date'].unique())
+    # a store that opens after the first cut: its series are first seen by a later incremental update
+    for t in ('store_rollup', 'category_rollup'):
+        df = tables[t]; new = df[(df['store_id'] == df['store_id'].min()) & (df['date'] >= days[25])].assign(store_id=999)
+        tables[t] = pd.concat([df, new], ignore_index=True); tables[t].to_csv(f'{full}/{t}.csv', index=False)
+    ref = anomaly.update(str(full))
+    # the same tables, revealed to the detector in three steps
+    for cut in (days[20], days[33], days[-1]):
+        for t, df in tables.items(): df[df['date'] <= cut].to_csv(f'{inc}/{t}.csv', index=False)
+        got = anomaly.update(str(inc))
+    for level, spec in anomaly.LEVELS.items():
+        for m in spec['metrics']:
+            a = anomaly.query(got, 0.0, level, m); b = anomaly.query(ref, 0.0, level, m)
+            pd.testing.assert_frame_equal(a[a.columns[:-1]], b[b.columns[:-1]])
+            np.testing.assert_allclose(a['z'], b['z'], rtol=1e-9)
+
+
+def _anomaly_inputs(raw, out):
+    os.makedirs(out, exist_ok=True)
+    preprocess_sales.preprocess(f'{raw}/transactions.csv', f'{raw}/visits.csv', f'{out}/daily_sales.csv')
+    rollup.build_rollups(f'{raw}/transactions.csv', f'{raw}/products.csv', f'{raw}/stores.csv', str(out))
+
+
+def test_rewritten_history_rebuilds_anomaly_state(raw, regenerated, tmp_path):
+    # a regenerated dataset over the same dates must not extend the old history
+    work, ref_dir = tmp_path / 'work', tmp_path / 'ref'
+    _anomaly_inputs(raw, work); anomaly.update(str(work))
+    _anomaly_inputs(regenerated, work); got = anomaly.update(str(work))
+    _anomaly_inputs(regenerated, ref_dir); ref = anomaly.update(str(ref_dir), persist=False)
+    for level, spec in anomaly.LEVELS.items():
+        for m in spec['metrics']:
+            pd.testing.assert_frame_equal(anomaly.query(got, 0.0, level, m), anomaly.query(ref, 0.0, level, m))
+    assert not os.path.exists(ref_dir / anomaly.STATE_FILE)
+
+
+def _basket_tx(raw):
+    return storage.read(f'{raw}/transactions.csv', columns=['order_id', 'date', 'store_id', 'product_id'])
+
+
+def _assert_same_basket(a, b):
+    for table, keys, value in (('pairs', basket.KEYS + ['p1', 'p2'], 'count'), ('items', basket.KEYS + ['product_id'], 'orders'),
+                               ('orders', basket.KEYS, 'orders')):
+        x, y = (c[table].sort_values(keys, ignore_index=True)[keys + [value]] for c in (a, b))
+        pd.testing.assert_frame_equal(x, y, check_dtype=False)
+    assert a['fingerprint'] == b['fingerprint'] and a['rows'] == b['rows']
+
+
+def test_basket_append_matches_full_build(raw):
+    tx = _basket_tx(raw); first = tx[tx['order_id'] <= tx['order_id'].median()]
+    _assert_same_basket(basket.update(basket.build(first), tx), basket.build(tx))
+
+
+def test_basket_rebuilds_when_a_larger_file_was_regenerated(raw, regenerated):
+    old, new = _basket_tx(raw), _basket_tx(regenerated)
+    assert len(new) > len(old) and new['order_id'].max() > old['order_id'].max()  # passes the old "shrunk?" check
+    _assert_same_basket(basket.update(basket.build(old), new), basket.build(new))
+
+
+def _rollups(raw, tx, out):
+    return rollup.build_rollups(tx, f'{raw}/products.csv', f'{raw}/stores.csv', str(out), incremental=False)
+
+
+def test_incremental_rollups_match_full_build(raw, tmp_path):
+    tx = pd.read_csv(f'{raw}/transactions.csv'); cut = sorted(tx['date'].unique())[30]
+    inc, full = tmp_path / 'inc', tmp_path / 'full'
+    os.makedirs(inc); tx[tx['date'] <= cut].to_csv(inc / 'transactions.csv', index=False); _rollups(raw, inc / 'transactions.csv', inc)
+    tx.to_csv(inc / 'transactions.csv', index=False)  # the later days are appended
+    got = rollup.build_rollups(inc / 'transactions.csv', f'{raw}/products.csv', f'{raw}/stores.csv', str(inc), incremental=True)
+    ref = _rollups(raw, f'{raw}/transactions.csv', full)
+    for a, b in zip(got, ref): pd.testing.assert_frame_equal(a, b)
+
+
+def test_rollup_rebuild_after_regenerating_matches_transactions(raw, regenerated, tmp_path):
+    _rollups(raw, f'{raw}/transactions.csv', tmp_path)
+    cat, sto = rollup.build_rollups(f'{regenerated}/transactions.csv', f'{regenerated}/products.csv', f'{regenerated}/stores.csv', str(tmp_path))
+    tx = pd.read_csv(f'{regenerated}/transactions.csv', parse_dates=['date'])
+    for cube in (cat, sto):
+        assert cube['revenue'].sum() == pytest.approx(tx['revenue'].sum()) and cube['units'].sum() == tx['quantity'].sum()
+    orders = tx.groupby(['date', 'store_id'])['order_id'].nunique().to_numpy()
+    assert (sto.set_index(['date', 'store_id'])['orders'].to_numpy() == orders).all()
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_chunked_rfm_features_match_batch(raw, tmp_path, shuffle):
+    tx = f'{raw}/transactions.csv'
+    if shuffle: tx = str(tmp_path / 'transactions.csv'); pd.read_csv(f'{raw}/transactions.csv').sample(frac=1, random_state=0).to_csv(tx, index=False)
+    got = train_models.rfm_features(tx, chunksize=37); ref = train_models.rfm_features(f'{raw}/transactions.csv')
+    pd.testing.assert_frame_equal(got[['customer_id', 'recency', 'frequency']], ref[['customer_id', 'recency', 'frequency']])
+    np.testing.assert_allclose(got['monetary'], ref['monetary'], rtol=1e-9)
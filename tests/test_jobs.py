@@ -0,0 +1,42 @@
+"""Background job runner: clean-up after every outcome and bounded job history.
+
+    python -m pytest -q tests
+"""
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from jobs import JobRunner
+
+
+def _wait(job, timeout=30):
+    t0 = time.time()
+    while job['finished_at'] is None and time.time() - t0 < timeout: time.sleep(0.01)
+    return job
+
+
+def _staged(tmp_path, code):
+    def make(job):
+        d = tmp_path / 'staging' / job['id']; os.makedirs(d); return [sys.executable, '-c', code]
+    return make
+
+
+def _drop(tmp_path):
+    return lambda job: (tmp_path / 'staging' / job['id']).rmdir()
+
+
+def test_on_finish_runs_for_failed_and_raising_jobs(tmp_path):
+    runner = JobRunner(str(tmp_path / 'logs'))
+    def swap(job): raise RuntimeError('swap failed')
+    failed, _ = runner.submit('a', _staged(tmp_path, 'import sys; sys.exit(3)'), on_finish=_drop(tmp_path))
+    raised, _ = runner.submit('b', _staged(tmp_path, 'pass'), on_success=swap, on_finish=_drop(tmp_path))
+    runner._pool.shutdown(wait=True)
+    assert (failed['status'], failed['returncode']) == ('failed', 3)
+    assert raised['status'] == 'failed' and 'swap failed' in raised['error']
+    assert os.listdir(tmp_path / 'staging') == []
+
+
+def test_only_the_most_recent_finished_jobs_are_kept(tmp_path):
+    runner = JobRunner(str(tmp_path / 'logs'), keep=2)
+    jobs = [_wait(runner.submit(i, lambda job: [sys.executable, '-c', 'pass'])[0]) for i in range(5)]
+    runner._pool.shutdown(wait=True)
+    assert [j['id'] for j in runner.list()] == [j['id'] for j in jobs[:-3:-1]]
+    assert sorted(os.listdir(tmp_path / 'logs')) == sorted(f"{j['id']}.log" for j in jobs[-2:])